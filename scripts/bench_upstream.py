@@ -0,0 +1,142 @@
+"""
+Compare /login and /public/menu latency while the upstream POS menu is slow,
+for the sync WSGI deployment (gunicorn sync workers) vs the ASGI entry point.
+
+    python scripts/bench_upstream.py [--delay 3] [--inflight 60] [--workers 2] [--client-timeout 30]
+
+Needs gunicorn, uvicorn, httpx and a2wsgi installed (see server/requirements.txt).
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "server"
+MENU = {"data": {"categories": [{"ref": "T", "name": "Traditional"}],
+                 "products": [{"category_ref": "T", "name": "Margherita"}]}}
+
+stub_delay = 0.0
+
+
+class SlowMenu(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(stub_delay)
+        body = json.dumps(MENU).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode: str, port: int, upstream: str, db_path: str, workers: int):
+    env = dict(os.environ, POS_MENU_URL=upstream, DB_DIR=os.path.dirname(db_path), POS_DB_PATH=db_path,
+               PYTHONUNBUFFERED="1")
+    if mode == "sync":
+        # Explicit sync workers: gunicorn.conf.py (picked up from cwd) defaults to gthread
+        cmd = [sys.executable, "-m", "gunicorn", "-k", "sync", "--threads", "1",
+               "-w", str(workers), "-b", f"127.0.0.1:{port}",
+               "--timeout", "120", "app:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(port),
+               "--workers", str(workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=SERVER_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            requests.get(base + "/", timeout=1)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def timed(fn) -> tuple[float, bool]:
+    """(elapsed ms, succeeded); timeouts count as failures at the time they gave up."""
+    t0 = time.perf_counter()
+    try:
+        ok = fn().ok
+    except requests.RequestException:
+        ok = False
+    return (time.perf_counter() - t0) * 1000, ok
+
+
+def summary(results: list[tuple[float, bool]]) -> str:
+    samples = sorted(ms for ms, _ in results)
+    failed = sum(1 for _, ok in results if not ok)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    return (f"p50={statistics.median(samples):8.1f}ms  p95={p95:8.1f}ms  "
+            f"max={samples[-1]:8.1f}ms  failed={failed}/{len(samples)}")
+
+
+def run(mode: str, args, upstream: str) -> None:
+    global stub_delay
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    proc, base = start_server(mode, free_port(), upstream, db_path, args.workers)
+    try:
+        creds = {"phone": "0412345678", "password": "bench-pass"}
+        requests.post(base + "/register", json=creds, timeout=30)
+        login = lambda: requests.post(base + "/login", json=creds, timeout=args.client_timeout)  # noqa: E731
+        menu = lambda: requests.get(base + "/public/menu", timeout=args.client_timeout)  # noqa: E731
+
+        stub_delay = 0.0
+        idle_login = [timed(login) for _ in range(5)]
+        idle_menu = [timed(menu) for _ in range(5)]
+
+        stub_delay = args.delay
+        with ThreadPoolExecutor(args.inflight) as pool:
+            slow = [pool.submit(timed, menu) for _ in range(args.inflight)]
+            time.sleep(0.5)  # let the slow menu calls occupy the server
+            busy_login = [timed(login) for _ in range(5)]
+            slow_menu = [f.result() for f in slow]
+
+        print(f"[{mode}] idle  login: {summary(idle_login)}")
+        print(f"[{mode}] idle  menu : {summary(idle_menu)}")
+        print(f"[{mode}] login while {args.inflight} menu calls wait {args.delay:.0f}s upstream: {summary(busy_login)}")
+        print(f"[{mode}] those slow menu calls: {summary(slow_menu)}")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--delay", type=float, default=3.0, help="artificial upstream delay (seconds)")
+    ap.add_argument("--inflight", type=int, default=60, help="concurrent slow menu requests")
+    ap.add_argument("--workers", type=int, default=2, help="server worker processes")
+    ap.add_argument("--client-timeout", type=float, default=30.0, help="per-request client timeout (seconds)")
+    args = ap.parse_args()
+
+    stub = ThreadingHTTPServer(("127.0.0.1", free_port()), SlowMenu)
+    stub.daemon_threads = True
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    upstream = f"http://127.0.0.1:{stub.server_address[1]}/menu"
+
+    for mode in ("sync", "async"):
+        run(mode, args, upstream)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Check that concurrent misses for the same image cost one upstream fetch:
+N clients request /api/images/<new name> at once against a slow stub upstream,
+and the stub counts how often it was hit. Runs gunicorn (several workers x
+threads, so coalescing has to work across processes too) and the ASGI app.
+
+    python scripts/check_image_coalescing.py [--clients 40] [--workers 3] [--delay 1]
+
+Needs gunicorn and uvicorn installed (see server/requirements.txt).
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "server"
+# 1x1 transparent PNG
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d49444154789c6360000002000005000157a2d1d80000000049454e44ae426082"
+)
+
+stub_delay = 0.0
+hits = Counter()
+hits_lock = threading.Lock()
+
+
+class SlowImages(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with hits_lock:
+            hits[self.path] += 1
+        time.sleep(stub_delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(PNG)))
+        self.end_headers()
+        self.wfile.write(PNG)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode: str, port: int, upstream: str, workers: int):
+    data_dir = tempfile.mkdtemp()
+    env = dict(os.environ, POS_IMAGES_URL=upstream, DB_DIR=data_dir,
+               POS_DB_PATH=os.path.join(data_dir, "check.db"), PYTHONUNBUFFERED="1")
+    if mode == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-w", str(workers),
+               "--threads", "16", "-b", f"127.0.0.1:{port}", "app:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(port),
+               "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=SERVER_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            requests.get(base + "/", timeout=1)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def run(mode: str, upstream: str, clients: int, workers: int) -> bool:
+    proc, base = start_server(mode, free_port(), upstream, workers)
+    name = f"new-product-{mode}.png"
+    try:
+        barrier = threading.Barrier(clients)
+
+        def one(_):
+            barrier.wait()
+            r = requests.get(f"{base}/api/images/{name}", timeout=30)
+            return r.status_code, r.content == PNG
+
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = Counter(pool.map(one, range(clients)))
+        upstream_calls = hits[f"/{name}"]
+        ok = upstream_calls == 1 and results == Counter({(200, True): clients})
+        print(f"[{mode}] {clients} concurrent misses -> {upstream_calls} upstream call(s); "
+              f"responses {dict(results)} {'OK' if ok else 'FAIL'}")
+        return ok
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    global stub_delay
+    ap = argparse.ArgumentParser(description="image miss coalescing check")
+    ap.add_argument("--clients", type=int, default=40)
+    ap.add_argument("--workers", type=int, default=3, help="gunicorn worker processes")
+    ap.add_argument("--delay", type=float, default=1.0, help="stub upstream latency (s)")
+    args = ap.parse_args()
+    stub_delay = args.delay
+
+    stub = ThreadingHTTPServer(("127.0.0.1", free_port()), SlowImages)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    upstream = f"http://127.0.0.1:{stub.server_address[1]}"
+
+    ok = all([run(mode, upstream, args.clients, args.workers) for mode in ("gunicorn", "asgi")])
+    stub.shutdown()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Measure request-path commit latency while an online DB backup runs.
+
+Seeds a throwaway SQLite DB, then keeps committing small writes through the
+app's own session (like /login and /register do) at a steady rate while
+backups run back to back, in three phases:
+
+  baseline     no backup
+  stepped      app.run_db_backup() with the default page steps + sleeps
+  single-step  the whole copy in one backup step (what a naive backup does)
+
+    python scripts/measure_backup_latency.py [--mb 40] [--rate 20] [--seconds 4] [--wal]
+
+With --wal (POS_SQLITE_WAL=1) both backup phases run as one snapshot step.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "server"
+
+
+def pct(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else float("nan")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="commit latency during online backups")
+    ap.add_argument("--mb", type=int, default=40, help="approximate DB size to seed")
+    ap.add_argument("--rate", type=float, default=20, help="writes per second")
+    ap.add_argument("--seconds", type=float, default=4, help="duration of each phase")
+    ap.add_argument("--wal", action="store_true", help="run the app with POS_SQLITE_WAL=1")
+    args = ap.parse_args()
+
+    data_dir = tempfile.mkdtemp()
+    os.environ.update(DB_DIR=data_dir, POS_DB_PATH=os.path.join(data_dir, "users.db"), POS_BACKUP_KEEP="2",
+                      POS_SQLITE_WAL="1" if args.wal else "0")
+    sys.path.insert(0, str(SERVER_DIR))
+    import app as pos
+
+    with pos.app.app_context():
+        db_path = pos._sqlite_db_path()
+        rows = [
+            {"phone": f"+6140{i:07d}", "display_name": f"user {i}", "profile_json": "x" * 4000}
+            for i in range(args.mb * 250)
+        ]
+        pos.db.session.execute(pos.insert(pos.User), rows)
+        pos.db.session.commit()
+    print(f"seeded {os.path.getsize(db_path) / 1e6:.1f} MB")
+
+    def phase(label: str, backup_pages: int | None):
+        latencies, backups = [], []
+        stop = threading.Event()
+
+        def writer():
+            interval = 1.0 / args.rate
+            with pos.app.app_context():
+                while not stop.is_set():
+                    t0 = time.perf_counter()
+                    pos.db.session.add(pos.AdminAudit(actor_user_id=1, action="bench", detail=label))
+                    pos.db.session.commit()
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                    time.sleep(max(0.0, interval - (time.perf_counter() - t0)))
+
+        t = threading.Thread(target=writer)
+        t.start()
+        deadline = time.monotonic() + args.seconds
+        while time.monotonic() < deadline:
+            if backup_pages is None:
+                time.sleep(0.05)
+                continue
+            stats = pos.run_db_backup(db_path, pages_per_step=backup_pages)
+            if stats:
+                backups.append(stats)
+        stop.set()
+        t.join()
+
+        line = (f"[{label:11}] {len(latencies)} commits: p50 {statistics.median(latencies):6.2f} ms  "
+                f"p99 {pct(latencies, 0.99):7.2f} ms  max {max(latencies):7.2f} ms")
+        if backups:
+            line += (f" | {len(backups)} backup(s), avg {statistics.mean(b['seconds'] for b in backups):.2f}s, "
+                     f"restarts {sum(b['restarts'] for b in backups)}, modes {sorted({b['mode'] for b in backups})}")
+        print(line)
+
+    phase("baseline", None)
+    phase("stepped", pos.BACKUP_PAGES_PER_STEP)
+    phase("single-step", 0)
+    print("backups kept:", [p.name for p in pos._list_backups()])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Measure gunicorn time-to-ready and per-worker memory, with and without the
+preload-safe config (server/gunicorn.conf.py). Linux only (/proc).
+
+    python scripts/measure_workers.py [--workers 4]
+
+RSS counts shared pages in every worker; PSS splits them fairly and USS is
+what each worker owns alone, so preload shows up as lower PSS/USS.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "server"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def memory_kb(pid: int) -> dict:
+    """Rss/Pss plus USS (private clean + dirty) from smaps_rollup."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def children(pid: int) -> list[int]:
+    out = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True, text=True).stdout
+    return [int(p) for p in out.split()]
+
+
+def run(label: str, extra_args: list[str], workers: int) -> None:
+    port = free_port()
+    env = dict(os.environ, POS_DB_PATH=os.path.join(tempfile.mkdtemp(), "measure.db"),
+               WEB_CONCURRENCY=str(workers), PORT=str(port))
+    cmd = [sys.executable, "-m", "gunicorn", *extra_args, "-w", str(workers),
+           "-b", f"127.0.0.1:{port}", "app:app"]
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_ok = None
+        while time.perf_counter() - t0 < 60:
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/", timeout=1).ok:
+                    first_ok = time.perf_counter() - t0
+                    break
+            except requests.RequestException:
+                time.sleep(0.02)
+        # Let every worker finish booting, then warm each with a few requests
+        while len(children(proc.pid)) < workers and time.perf_counter() - t0 < 60:
+            time.sleep(0.05)
+        all_ready = time.perf_counter() - t0
+        for _ in range(workers * 5):
+            requests.get(f"http://127.0.0.1:{port}/public/images", timeout=5)
+        time.sleep(0.5)
+
+        mems = [memory_kb(pid) for pid in children(proc.pid)]
+        master = memory_kb(proc.pid)
+        avg = {k: sum(m[k] for m in mems) / max(1, len(mems)) / 1024 for k in ("rss", "pss", "uss")}
+        total_pss = (sum(m["pss"] for m in mems) + master["pss"]) / 1024
+        print(f"[{label}] first response {first_ok or float('nan'):.2f}s, all {len(mems)} workers up {all_ready:.2f}s")
+        print(f"[{label}] per worker: RSS {avg['rss']:.1f} MiB  PSS {avg['pss']:.1f} MiB  USS {avg['uss']:.1f} MiB; "
+              f"total PSS incl. master {total_pss:.1f} MiB")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="gunicorn worker memory / startup comparison")
+    ap.add_argument("--workers", type=int, default=4)
+    args = ap.parse_args()
+    # gunicorn picks up ./gunicorn.conf.py by default, so the baseline needs an explicit empty config
+    empty_conf = os.path.join(tempfile.mkdtemp(), "empty.conf.py")
+    Path(empty_conf).write_text("")
+    run("no preload", ["-c", empty_conf], args.workers)
+    run("gunicorn.conf.py (preload)", ["-c", "gunicorn.conf.py"], args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Batch image optimizer for public/ and the server upload dirs.
+
+For every PNG/JPEG/WebP under the given roots it writes, into <root>/optimized/:
+  - a re-encoded full-size copy in the source format,
+  - responsive downscales (see --widths) in the source format,
+  - WebP variants of all of the above.
+Banners (--trim glob) are first cropped to their content bounds, like
+crop_banner.py. Work is spread over a process pool. Inputs whose content
+hash and settings are unchanged since the last run are skipped via
+<root>/optimized/.asset-cache.json.
+
+    python scripts/optimize_assets.py                      # public/ + server upload dirs
+    python scripts/optimize_assets.py public --widths 640,1280 --jobs 4
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_ROOTS = [
+    REPO_ROOT / "public",
+    REPO_ROOT / "server" / "static" / "uploads",
+    REPO_ROOT / "server" / "data" / "uploads",
+]
+OUT_DIRNAME = "optimized"
+CACHE_NAME = ".asset-cache.json"
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp"}
+
+
+def content_bounds(arr: np.ndarray, alpha_min: int = 10, luma_min: int = 30, pad: int = 10):
+    """
+    (x0, y0, x1, y1) crop box around "real content" in an RGBA array: pixels
+    that aren't transparent or basically black. Uses per-row/column any()
+    reductions instead of np.where over the whole mask. None if empty.
+    """
+    mask = (arr[:, :, 3] > alpha_min) & (arr[:, :, :3].max(axis=2) > luma_min)
+    rows = mask.any(axis=1)
+    cols = mask.any(axis=0)
+    if not rows.any():
+        return None
+    y0 = int(rows.argmax())
+    y1 = len(rows) - int(rows[::-1].argmax())
+    x0 = int(cols.argmax())
+    x1 = len(cols) - int(cols[::-1].argmax())
+    h, w = mask.shape
+    return max(0, x0 - pad), max(0, y0 - pad), min(w, x1 + pad), min(h, y1 + pad)
+
+
+def _save(im: Image.Image, path: Path, fmt: str) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "WEBP":
+        im.save(path, "WEBP", quality=82, method=6)
+    elif fmt == "JPEG":
+        im.convert("RGB").save(path, "JPEG", quality=85, optimize=True, progressive=True)
+    else:
+        im.save(path, "PNG", optimize=True)
+    return path.stat().st_size
+
+
+def process_image(job: dict) -> dict:
+    """Worker: emit all variants for one source image; returns sizes for the report/cache."""
+    src = Path(job["src"])
+    out_base = Path(job["out_base"])
+    src_size = src.stat().st_size
+    im = Image.open(src)
+    fmt = "JPEG" if im.format == "JPEG" else ("WEBP" if im.format == "WEBP" else "PNG")
+    im = im.convert("RGBA") if fmt != "JPEG" else im.convert("RGB")
+
+    if job["trim"] and im.mode == "RGBA":
+        box = content_bounds(np.asarray(im))
+        if box:
+            im = im.crop(box)
+
+    ext = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}[fmt]
+    outputs = {}
+    full_sizes = []
+    for width in [None] + [w for w in job["widths"] if w < im.width]:
+        variant = im
+        suffix = ""
+        if width:
+            variant = im.resize((width, round(im.height * width / im.width)), Image.LANCZOS)
+            suffix = f"-{width}w"
+        native = out_base.with_name(out_base.name + suffix + ext)
+        webp = out_base.with_name(out_base.name + suffix + ".webp")
+        sizes = [_save(variant, native, fmt)]
+        outputs[str(native)] = sizes[0]
+        if fmt != "WEBP":
+            sizes.append(_save(variant, webp, "WEBP"))
+            outputs[str(webp)] = sizes[1]
+        if width is None:
+            full_sizes = sizes
+
+    return {
+        "src": str(src),
+        "src_size": src_size,
+        "best_full_size": min(full_sizes),
+        "outputs": outputs,
+    }
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _collect(root: Path) -> list[Path]:
+    out_dir = root / OUT_DIRNAME
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".") and Path(dirpath, d) != out_dir]
+        for name in filenames:
+            if Path(name).suffix.lower() in IMAGE_EXTS and not name.startswith("."):
+                files.append(Path(dirpath, name))
+    return sorted(files)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Optimize images under public/ and upload dirs.")
+    ap.add_argument("roots", nargs="*", type=Path, help="dirs to process (default: public/ + upload dirs)")
+    ap.add_argument("--widths", default="480,960,1600", help="responsive widths (px), comma separated")
+    ap.add_argument("--trim", default="*banner*", help="glob of filenames to crop to content bounds ('' = none)")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    ap.add_argument("--force", action="store_true", help="ignore the hash cache")
+    args = ap.parse_args()
+
+    widths = sorted({int(w) for w in args.widths.split(",") if w.strip()})
+    settings = json.dumps({"widths": widths, "trim": args.trim}, sort_keys=True)
+    roots = [r.resolve() for r in (args.roots or DEFAULT_ROOTS) if r.is_dir()]
+
+    jobs, caches, skipped = [], {}, 0
+    for root in roots:
+        cache_path = root / OUT_DIRNAME / CACHE_NAME
+        try:
+            cache = json.loads(cache_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            cache = {}
+        caches[root] = (cache_path, cache)
+        for src in _collect(root):
+            rel = src.relative_to(root).as_posix()
+            digest = _sha256(src)
+            known = cache.get(rel)
+            if (not args.force and known and known["sha256"] == digest and known["settings"] == settings
+                    and all(Path(p).exists() for p in known["outputs"])):
+                skipped += 1
+                continue
+            jobs.append({
+                "root": str(root),
+                "rel": rel,
+                "sha256": digest,
+                "src": str(src),
+                "out_base": str((root / OUT_DIRNAME / rel).with_suffix("")),
+                "widths": widths,
+                "trim": bool(args.trim) and fnmatch.fnmatch(src.name.lower(), args.trim.lower()),
+            })
+
+    total_in = total_best = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        for job, res in zip(jobs, pool.map(process_image, jobs)):
+            cache_path, cache = caches[Path(job["root"])]
+            cache[job["rel"]] = {"sha256": job["sha256"], "settings": settings, "outputs": res["outputs"]}
+            total_in += res["src_size"]
+            total_best += res["best_full_size"]
+            saved = res["src_size"] - res["best_full_size"]
+            print(f"{job['rel']}: {res['src_size']:>10,} -> {res['best_full_size']:>10,} bytes "
+                  f"({saved / max(1, res['src_size']):6.1%} saved, {len(res['outputs'])} files)")
+
+    for cache_path, cache in caches.values():
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps(cache, indent=1, sort_keys=True), encoding="utf-8")
+
+    print(f"\nprocessed {len(jobs)} image(s), skipped {skipped} unchanged")
+    if jobs:
+        print(f"full-size bytes: {total_in:,} -> {total_best:,} "
+              f"(saved {total_in - total_best:,}, {(total_in - total_best) / max(1, total_in):.1%})")
+
+
+if __name__ == "__main__":
+    main()
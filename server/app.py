@@ -1,13 +1,22 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, send_from_directory, Response
+from flask import Flask, Blueprint, current_app, request, jsonify, render_template, redirect, url_for, send_from_directory, Response, stream_with_context, g
+import cProfile
+import csv
+import io
 import json
 import os
+import pstats
+import random
 import re
 import requests
 from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 from datetime import datetime, timedelta
 import secrets
+import sqlite3
+import threading
 import time
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
 from functools import wraps
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 import firebase_admin
@@ -21,12 +30,22 @@ try:
 except Exception:
     pass
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
+from sqlalchemy import text, select, update, insert, delete, event, func
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import OperationalError
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS
+from image_sync import IMAGE_EXTS, atomic_write_bytes, sync_images
+import bisect
+import hashlib
+import struct
+import unicodedata
+import zlib
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: in-process locking only
+    fcntl = None
 
-app = Flask(__name__, static_folder=None)
 IS_PROD = (os.getenv("FLASK_ENV") or "").lower() == "production" or (os.getenv("RENDER") == "true")
 _raw_origins = (os.getenv("POS_ALLOWED_ORIGINS") or "").strip()
 if _raw_origins:
@@ -43,20 +62,13 @@ else:
         "http://127.0.0.1:5173",
     ]
 
-CORS(
-    app,
-    resources={r"/*": {"origins": ALLOWED_ORIGINS}},
-    allow_headers=[
-        "Content-Type", "content-type",
-        "Authorization",
-        "X-API-Key", "x-api-key",
-        "Accept", "Origin",
-    ],
-    methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-    supports_credentials=False,
-)
+CORS_MAX_AGE_SECONDS = int(os.getenv("POS_CORS_MAX_AGE", "600"))
 
-@app.after_request
+# Routes, hooks and CLI commands live on this blueprint; create_app() wires it up
+bp = Blueprint("pos", __name__, cli_group=None)
+db = SQLAlchemy()
+
+@bp.after_app_request
 def _cors_preflight_fix(resp):
     # If browser preflight asked for headers, echo them back
     req_headers = request.headers.get("Access-Control-Request-Headers")
@@ -70,18 +82,11 @@ def _cors_preflight_fix(resp):
     )
     return resp
 
-# Ensure instance folder exists for SQLite relative paths (Flask-SQLAlchemy uses it)
-try:
-    Path(app.instance_path).mkdir(parents=True, exist_ok=True)
-except Exception as e:
-    print("[db] failed to create instance dir:", e)
-
-app.config["SECRET_KEY"] = os.getenv("POS_SECRET_KEY", "dev-change-me-now")
 TOKEN_SALT = "pp_auth_v1"
 TOKEN_MAX_AGE_SECONDS = int(os.getenv("POS_TOKEN_MAX_AGE", "259200"))  # 3 days
 
 def _serializer():
-    return URLSafeTimedSerializer(app.config["SECRET_KEY"], salt=TOKEN_SALT)
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt=TOKEN_SALT)
 
 def make_token(payload: dict) -> str:
     return _serializer().dumps(payload)
@@ -117,15 +122,22 @@ def client_ip():
         return xff.split(",")[0].strip()
     return request.remote_addr or "unknown"
 
+def user_from_bearer(tok: str | None = None):
+    """Active User for `tok` (default: the request's bearer token), or None."""
+    tok = tok or get_bearer_token()
+    data = read_token(tok) if tok else None
+    if not data or not data.get("uid"):
+        return None
+    u = User.query.get(int(data["uid"]))
+    if not u or not u.is_active:
+        return None
+    return u
+
 def auth_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        tok = get_bearer_token()
-        data = read_token(tok) if tok else None
-        if not data or not data.get("uid"):
-            return jsonify({"ok": False, "error": "Unauthorized"}), 401
-        u = User.query.get(int(data["uid"]))
-        if not u or not u.is_active:
+        u = user_from_bearer()
+        if not u:
             return jsonify({"ok": False, "error": "Unauthorized"}), 401
         request.pp_user = u
         return fn(*args, **kwargs)
@@ -180,35 +192,15 @@ def init_firebase_admin():
     except Exception as e:
         print("[auth] firebase-admin init failed:", e)
 
-# init once
-if not firebase_admin._apps:
-    init_firebase_admin()
-
 # --- DB path (Render persistent disk friendly) ---
 DB_PATH = os.getenv("POS_DB_PATH", "").strip()
-if DB_PATH:
-    # Ensure parent directory exists (Render disk mount, etc.)
-    try:
-        parent = os.path.dirname(DB_PATH)
-        if parent:
-            os.makedirs(parent, exist_ok=True)
-    except Exception as e:
-        print("[db] failed to create DB dir:", e)
-
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DB_PATH}"
-else:
-    # local/dev fallback
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///users.db"
-
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db = SQLAlchemy(app)
 
 def _ensure_db_ready() -> bool:
     try:
-        db.create_all()
+        run_migrations()
         return True
     except Exception as e:
-        print("[db] create_all failed:", e)
+        print("[db] migrations failed:", e)
         return False
 
 def normalize_phone(s: str) -> str:
@@ -278,6 +270,422 @@ def _images_upstream_base() -> str:
 # Check persistent first, then repo bundled
 UPLOAD_DIRS = [PERSIST_UPLOAD_DIR, UPLOAD_DIR]
 
+# --- Admission control / load shedding ---
+# Each route class gets a concurrency limit and a bounded wait queue, per worker
+# process: POS_ADMISSION_<CLASS>="limit:queue:wait_seconds" (limit 0 = unlimited).
+# Over the limit and queue, or after waiting too long, the request gets a fast
+# 503 + Retry-After instead of tying up a thread.
+# Defaults are shares of the request threads per process, POS_WORKER_THREADS
+# (exported by gunicorn.conf.py and asgi.py). A queued request still holds its
+# thread, so limit + queue is what a class can occupy: slow classes stay well
+# below the pool and /login and /api/orders always find a free thread.
+WORKER_THREADS = max(1, int(os.getenv("POS_WORKER_THREADS", "8")))
+
+
+def _thread_share(fraction: float) -> int:
+    return max(1, int(WORKER_THREADS * fraction))
+
+
+ADMISSION_DEFAULTS = {
+    # image misses: fuzzy dir scans + upstream proxying
+    "upstream": f"{_thread_share(0.25)}:{_thread_share(0.125)}:1",
+    # password hashing / firebase verification
+    "auth": f"{_thread_share(0.5)}:{_thread_share(0.25)}:5",
+    "menu": f"{_thread_share(0.5)}:{_thread_share(0.25)}:5",
+    "orders": f"{_thread_share(0.75)}:{_thread_share(0.25)}:10",
+    "admin": f"{_thread_share(0.25)}:{_thread_share(0.125)}:5",
+}
+
+# Endpoint -> class; anything under "pos.admin_" falls into "admin" (see _admission_class)
+ADMISSION_ROUTES = {
+    "pos.register": "auth",
+    "pos.login": "auth",
+    "pos.auth_firebase": "auth",
+    "pos.request_reset": "auth",
+    "pos.reset_password": "auth",
+    "pos.admin_bootstrap": "auth",
+    "pos.public_menu": "menu",
+    "pos.public_menu_search": "menu",
+    "pos.public_bootstrap": "menu",
+    "pos.api_orders": "orders",
+}
+
+# Not gated here: monitoring must work under load, and the order stream takes
+# its own "stream" gate in the view because its slot has to outlive the view
+ADMISSION_EXEMPT = {"pos.admin_metrics", "pos.staff_orders_stream"}
+
+
+class AdmissionGate:
+    """Concurrency limit with a bounded wait queue; counters feed /admin/metrics."""
+
+    def __init__(self, name: str, limit: int, queue: int, wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self.retry_after = max(1, int(wait + 0.999))
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    def try_enter(self) -> bool:
+        if self.limit <= 0:
+            return True
+        with self._cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue:
+                self.shed_queue_full += 1
+                return False
+            self.waiting += 1
+            self.queued += 1
+            try:
+                ok = self._cond.wait_for(lambda: self.active < self.limit, timeout=self.wait)
+            finally:
+                self.waiting -= 1
+            if not ok:
+                self.shed_timeout += 1
+                return False
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def leave(self):
+        if self.limit <= 0:
+            return
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self):
+        """`with gate.admit():` around a section; raises Overloaded when shed."""
+        if not self.try_enter():
+            raise Overloaded(self)
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "queue": self.queue,
+                "waitSeconds": self.wait,
+                "active": self.active,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "shedQueueFull": self.shed_queue_full,
+                "shedTimeout": self.shed_timeout,
+            }
+
+
+class Overloaded(Exception):
+    def __init__(self, gate: AdmissionGate):
+        super().__init__(f"{gate.name} overloaded")
+        self.gate = gate
+
+
+def _admission_gate(name: str, default: str) -> AdmissionGate:
+    raw = (os.getenv(f"POS_ADMISSION_{name.upper()}") or default).strip()
+    try:
+        limit, queue, wait = raw.split(":")
+        return AdmissionGate(name, int(limit), int(queue), float(wait))
+    except ValueError:
+        print(f"[admission] bad POS_ADMISSION_{name.upper()}={raw!r}, using {default}")
+        limit, queue, wait = default.split(":")
+        return AdmissionGate(name, int(limit), int(queue), float(wait))
+
+
+admission_gates = {name: _admission_gate(name, spec) for name, spec in ADMISSION_DEFAULTS.items()}
+
+
+def _admission_class(endpoint: str | None) -> str | None:
+    if not endpoint or endpoint in ADMISSION_EXEMPT:
+        return None
+    if endpoint in ADMISSION_ROUTES:
+        return ADMISSION_ROUTES[endpoint]
+    if endpoint.startswith("pos.admin_"):
+        return "admin"
+    return None
+
+
+def _shed_response(gate: AdmissionGate, error: str = "Server busy, please retry"):
+    resp = jsonify({"ok": False, "error": error, "class": gate.name})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(gate.retry_after)
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+@bp.app_errorhandler(Overloaded)
+def _overloaded(e: Overloaded):
+    return _shed_response(e.gate)
+
+
+@bp.before_app_request
+def _admission_enter():
+    if request.method == "OPTIONS":
+        return None
+    cls = _admission_class(request.endpoint)
+    if cls is None:
+        return None
+    if (request.environ.get("asgi.scope") or {}).get("pp.upstream"):
+        # asgi.py already did the upstream wait on its event loop; coalesced requests
+        # arrive together and only serve that result, bounded by its WSGI thread pool
+        return None
+    gate = admission_gates[cls]
+    if not gate.try_enter():
+        return _shed_response(gate)
+    g.pp_admission = gate
+    return None
+
+
+@bp.teardown_app_request
+def _admission_leave(exc):
+    gate = g.pop("pp_admission", None)
+    if gate is not None:
+        gate.leave()
+
+# --- Opt-in request profiler ---
+# Triggered by a staff bearer token + "X-PP-Profile: 1", or by POS_PROFILE_SAMPLE_RATE (0..1).
+# Untriggered requests pay one header lookup; SQL hooks are only attached while a profile runs.
+PROFILE_HEADER = "X-PP-Profile"
+PROFILE_DIR = Path(os.getenv("POS_PROFILE_DIR", str(DB_DIR / "profiles")))
+PROFILE_KEEP = int(os.getenv("POS_PROFILE_KEEP", "50"))
+PROFILE_SAMPLE_RATE = float(os.getenv("POS_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ID_RE = re.compile(r"^[0-9]{8}T[0-9]{12}-[0-9a-f]{8}$")
+
+_profile_local = threading.local()
+# cProfile on Python 3.12+ is interpreter-wide, so only one profile runs at a time
+_profile_slot = threading.Lock()
+
+
+def _profile_sql_before(conn, cursor, statement, parameters, context, executemany):
+    prof = getattr(_profile_local, "current", None)
+    if prof is not None:
+        conn.info.setdefault("pp_query_start", []).append(time.perf_counter())
+
+
+def _profile_sql_after(conn, cursor, statement, parameters, context, executemany):
+    prof = getattr(_profile_local, "current", None)
+    starts = conn.info.get("pp_query_start")
+    if prof is not None and starts:
+        prof["sql"].append({
+            "statement": statement,
+            "executemany": executemany,
+            "duration_ms": round((time.perf_counter() - starts.pop()) * 1000, 3),
+        })
+
+
+# Query args never written to profiles: profiles are readable by every staff user
+PROFILE_REDACT_ARGS = {"token", "access_token", "key", "api_key", "apikey", "code", "password", "secret"}
+
+
+def _redact_url(url: str) -> str:
+    """`url` with the values of PROFILE_REDACT_ARGS query args replaced by "redacted"."""
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [
+        (k, "redacted" if k.lower() in PROFILE_REDACT_ARGS else v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _profile_upstream(result: dict, mode: str):
+    prof = getattr(_profile_local, "current", None)
+    if prof is not None:
+        prof["upstream"].append({
+            "url": _redact_url(result["url"]),
+            "mode": mode,
+            "status": result["status"],
+            "error": result["error"],
+            "duration_ms": round(result.get("elapsed_ms") or 0.0, 3),
+        })
+
+
+def _profile_trigger() -> str | None:
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    if request.headers.get(PROFILE_HEADER):
+        u = user_from_bearer()
+        if u and u.role in ("staff", "admin"):
+            return f"staff:{u.id}"
+    return None
+
+
+@bp.before_app_request
+def _profile_start():
+    trigger = _profile_trigger()
+    if not trigger or not _profile_slot.acquire(blocking=False):
+        return
+    now = datetime.utcnow()
+    prof = {
+        "id": f"{now:%Y%m%dT%H%M%S%f}-{secrets.token_hex(4)}",
+        "trigger": trigger,
+        "method": request.method,
+        "path": _redact_url(request.full_path.rstrip("?")),
+        "started_at": now.isoformat(timespec="milliseconds") + "Z",
+        "sql": [],
+        "upstream": [],
+        "t0": time.perf_counter(),
+        "profiler": cProfile.Profile(),
+    }
+    event.listen(Engine, "before_cursor_execute", _profile_sql_before)
+    event.listen(Engine, "after_cursor_execute", _profile_sql_after)
+    _profile_local.current = prof
+    g.pp_profile = prof
+    prof["profiler"].enable()
+
+
+def _profile_stop(status: int | None) -> dict | None:
+    prof = g.pop("pp_profile", None)
+    if prof is None:
+        return None
+    try:
+        prof["profiler"].disable()
+        _profile_local.current = None
+        event.remove(Engine, "before_cursor_execute", _profile_sql_before)
+        event.remove(Engine, "after_cursor_execute", _profile_sql_after)
+    finally:
+        _profile_slot.release()
+    prof["status"] = status
+    prof["duration_ms"] = round((time.perf_counter() - prof.pop("t0")) * 1000, 3)
+    try:
+        _write_profile(prof)
+    except Exception as e:
+        print("[profile] failed to write profile:", e)
+    return prof
+
+
+def _write_profile(prof: dict):
+    profiler = prof.pop("profiler")
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(60)
+    prof["stats"] = out.getvalue()
+    profiler.dump_stats(str(PROFILE_DIR / f"{prof['id']}.pstats"))
+    atomic_write_bytes(PROFILE_DIR / f"{prof['id']}.json", json.dumps(prof).encode("utf-8"))
+    # Bounded ring: ids sort chronologically, drop the oldest beyond PROFILE_KEEP
+    ids = sorted(p.stem for p in PROFILE_DIR.glob("*.json"))
+    for old_id in ids[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else ids:
+        for ext in (".json", ".pstats"):
+            try:
+                (PROFILE_DIR / f"{old_id}{ext}").unlink()
+            except FileNotFoundError:
+                pass
+
+
+@bp.after_app_request
+def _profile_finish(resp):
+    prof = _profile_stop(resp.status_code)
+    if prof is not None:
+        resp.headers["X-PP-Profile-Id"] = prof["id"]
+    return resp
+
+
+@bp.teardown_app_request
+def _profile_teardown(exc):
+    # Request died before after_request: still release the profiler slot
+    _profile_stop(None)
+
+
+UPSTREAM_TIMEOUT_SECONDS = 12
+
+
+@contextmanager
+def _file_lock(path: Path, blocking: bool = True):
+    """
+    Cross-process advisory lock on `path`; yields whether it was acquired.
+    Without fcntl (Windows) it always yields True.
+    """
+    if fcntl is None:
+        yield True
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _menu_upstream_request() -> tuple[str, dict] | None:
+    """(url, headers) for the live POS menu, or None when POS_MENU_URL is unset."""
+    pos_url = (os.getenv("POS_MENU_URL") or "").strip()
+    if not pos_url:
+        return None
+    pos_key = (os.getenv("POS_API_KEY") or "").strip()
+    headers = {"Accept": "application/json"}
+    if pos_key:
+        # send both header casings + bearer (covers most servers)
+        headers["X-API-Key"] = pos_key
+        headers["x-api-key"] = pos_key
+        headers["Authorization"] = f"Bearer {pos_key}"
+    return pos_url, headers
+
+
+def _image_upstream_request(safe: str) -> tuple[str, dict] | None:
+    """(url, headers) for an image on the upstream POS server, or None when not configured."""
+    upstream_base = _images_upstream_base()
+    if not upstream_base:
+        return None
+    key = _images_api_key()
+    headers = {}
+    # Apply key if we have one (supports both common patterns)
+    if key:
+        headers["x-api-key"] = key
+        headers["Authorization"] = f"Bearer {key}"
+    return f"{upstream_base}/{safe}", headers
+
+
+def _upstream_result(url: str, status: int | None = None, body: bytes = b"",
+                     content_type: str = "", error: str = "", elapsed_ms: float = 0.0) -> dict:
+    """Transport-neutral upstream outcome, shared by the sync and async (asgi.py) fetchers."""
+    return {"url": url, "status": status, "body": body, "content_type": content_type, "error": error,
+            "elapsed_ms": elapsed_ms}
+
+
+def _upstream_get(url: str, headers: dict) -> dict:
+    t0 = time.perf_counter()
+    try:
+        r = requests.get(url, headers=headers, timeout=UPSTREAM_TIMEOUT_SECONDS)
+        res = _upstream_result(url, r.status_code, r.content, r.headers.get("content-type") or "",
+                               elapsed_ms=(time.perf_counter() - t0) * 1000)
+    except Exception as e:
+        res = _upstream_result(url, error=f"{e.__class__.__name__}: {e}",
+                               elapsed_ms=(time.perf_counter() - t0) * 1000)
+    _profile_upstream(res, "sync")
+    return res
+
+
+def _prefetched_upstream(url: str) -> dict | None:
+    """
+    Result the ASGI front end (asgi.py) already fetched asynchronously for this
+    request, if any. Lets the views below build the response either way.
+    """
+    scope = request.environ.get("asgi.scope") or {}
+    result = scope.get("pp.upstream")
+    if result and result.get("url") == url:
+        _profile_upstream(result, "async-prefetch")
+        return result
+    return None
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
@@ -290,10 +698,10 @@ class User(db.Model):
     firebase_uid = db.Column(db.String(128), unique=True, nullable=True)
 
     display_name = db.Column(db.String(80), default="", nullable=False)
-    role = db.Column(db.String(16), default="customer", nullable=False)
+    role = db.Column(db.String(16), default="customer", nullable=False, index=True)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
 
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     last_login_at = db.Column(db.DateTime, nullable=True)
 
@@ -323,20 +731,6 @@ class User(db.Model):
         return check_password_hash(self.reset_code_hash, code)
 
 
-def _ensure_profile_column():
-    try:
-        table = User.__tablename__
-        with db.engine.connect() as conn:
-            res = conn.execute(text(f"PRAGMA table_info({table})"))
-            cols = [row[1] for row in res]  # (cid, name, type, ...)
-            if "profile_json" not in cols:
-                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN profile_json TEXT"))
-                conn.commit()
-                print("[db] added profile_json column")
-    except Exception as e:
-        print("[db] ensure profile column failed:", e)
-
-
 class AdminAudit(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     actor_user_id = db.Column(db.Integer, nullable=False)
@@ -344,18 +738,31 @@ class AdminAudit(db.Model):
     action = db.Column(db.String(64), nullable=False)
     detail = db.Column(db.String(512), nullable=True)
     ip = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class OrderEvent(db.Model):
+    """Accepted order as published to staff displays; every worker process tails this table."""
+    # AUTOINCREMENT: ids never go backwards after pruning, so they work as stream cursors
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
 
+def _audit_row(actor_id: int, action: str, target_id: int | None = None, detail: str = "") -> dict:
+    return {
+        "actor_user_id": actor_id,
+        "target_user_id": target_id,
+        "action": action,
+        "detail": detail[:512],
+        "ip": client_ip(),
+    }
+
+
 def audit(actor_id: int, action: str, target_id: int | None = None, detail: str = ""):
-    a = AdminAudit(
-        actor_user_id=actor_id,
-        target_user_id=target_id,
-        action=action,
-        detail=detail[:512],
-        ip=client_ip(),
-    )
-    db.session.add(a)
+    db.session.add(AdminAudit(**_audit_row(actor_id, action, target_id, detail)))
     db.session.commit()
 
 
@@ -368,12 +775,336 @@ def should_bootstrap_admin(phone_raw: str, phone_normalized: str) -> bool:
     return existing_admin is None
 
 
-with app.app_context():
-    if _ensure_db_ready():
-        _ensure_profile_column()
+# --- Schema migrations ---
+# Ordered and append-only: never edit or reorder an entry once it has shipped.
+# The baseline builds tables at the current model shape, so later migrations
+# must tolerate running against a fresh database (use IF NOT EXISTS / _has_column).
+
+def _has_column(conn, table: str, column: str) -> bool:
+    res = conn.exec_driver_sql(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in res)  # (cid, name, type, ...)
+
+
+def _m001_baseline(conn):
+    db.metadata.create_all(bind=conn)
+
+
+def _m002_user_profile_json(conn):
+    table = User.__tablename__
+    if not _has_column(conn, table, "profile_json"):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN profile_json TEXT")
+
+
+def _m003_hot_query_indexes(conn):
+    # Same names SQLAlchemy gives index=True columns, so fresh DBs are a no-op
+    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_user_created_at ON {User.__tablename__} (created_at)")
+    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_user_role ON {User.__tablename__} (role)")
+    conn.exec_driver_sql(
+        f"CREATE INDEX IF NOT EXISTS ix_admin_audit_created_at ON {AdminAudit.__tablename__} (created_at)"
+    )
+
+
+def _m004_order_event(conn):
+    OrderEvent.__table__.create(bind=conn, checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, "baseline", _m001_baseline),
+    (2, "user_profile_json", _m002_user_profile_json),
+    (3, "hot_query_indexes", _m003_hot_query_indexes),
+    (4, "order_event", _m004_order_event),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv("POS_MIGRATION_LOCK_TIMEOUT_MS", "30000"))
 
 
-@app.post("/register")
+def _current_schema_version(conn) -> int:
+    try:
+        return int(conn.exec_driver_sql("SELECT MAX(version) FROM schema_version").scalar() or 0)
+    except OperationalError:
+        # Table not created yet
+        return 0
+
+
+def run_migrations() -> int:
+    """
+    Bring the database up to SCHEMA_VERSION and return the resulting version.
+    Fast path is a single SELECT; pending migrations run inside BEGIN IMMEDIATE,
+    which takes SQLite's write lock so only one worker migrates while the rest
+    wait (up to POS_MIGRATION_LOCK_TIMEOUT_MS) and then find nothing to do.
+    """
+    with db.engine.connect() as conn:
+        if _current_schema_version(conn) >= SCHEMA_VERSION:
+            return SCHEMA_VERSION
+
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql(f"PRAGMA busy_timeout = {MIGRATION_LOCK_TIMEOUT_MS}")
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            conn.exec_driver_sql(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, name VARCHAR(64) NOT NULL, applied_at DATETIME NOT NULL)"
+            )
+            current = _current_schema_version(conn)
+            for version, name, fn in MIGRATIONS:
+                if version <= current:
+                    continue
+                fn(conn)
+                conn.exec_driver_sql(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.utcnow().isoformat(sep=" ")),
+                )
+                print(f"[db] applied migration {version:03d}_{name}")
+                current = version
+            conn.commit()
+            return current
+        except Exception:
+            conn.rollback()
+            raise
+
+
+@bp.cli.command("db-upgrade")
+def db_upgrade_command():
+    """Apply pending schema migrations."""
+    version = run_migrations()
+    print(f"[db] schema at version {version}")
+
+
+@bp.cli.command("db-status")
+def db_status_command():
+    """Show applied and pending schema migrations."""
+    with db.engine.connect() as conn:
+        current = _current_schema_version(conn)
+    for version, name, _ in MIGRATIONS:
+        state = "applied" if version <= current else "pending"
+        print(f"{version:03d}_{name}: {state}")
+
+
+# --- Online SQLite backups ---
+# sqlite3's backup API copies the live DB a few pages per step; each step holds
+# the source read lock only briefly and we sleep between steps, so request
+# commits queue behind one short step instead of the whole copy.
+BACKUP_DIR = Path(os.getenv("POS_BACKUP_DIR", str(DB_DIR / "backups")))
+BACKUP_KEEP = int(os.getenv("POS_BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("POS_BACKUP_PAGES_PER_STEP", "64"))
+BACKUP_STEP_SLEEP = float(os.getenv("POS_BACKUP_STEP_SLEEP", "0.005"))  # seconds between steps
+BACKUP_INTERVAL = float(os.getenv("POS_BACKUP_INTERVAL", "0"))  # seconds; 0 = off
+# A commit from another connection restarts a stepped copy from page 1. Each
+# restart doubles the step size, so passes get shorter (fewer sleeps) until
+# one fits between writes; past the cap the copy finishes in a single step.
+BACKUP_MAX_RESTARTS = 10
+# <db stem>-<UTC stamp>.db; microseconds keep back-to-back backups apart
+# (older whole-second names still list and rotate)
+BACKUP_NAME_RE = re.compile(r"^.+-([0-9]{8}T[0-9]{6})(?:\.([0-9]{6}))?Z\.db$")
+
+_backup_lock = threading.Lock()
+_backup_thread = None
+_backup_status = {"running": False, "last": None}
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+# Opt-in WAL journal (POS_SQLITE_WAL=1): readers and writers stop blocking each
+# other and backups become a single non-blocking snapshot step. The mode sticks
+# to the DB file; the -wal/-shm side files must live on the same local disk.
+SQLITE_WAL = os.getenv("POS_SQLITE_WAL", "0") == "1"
+
+
+def _sqlite_enable_wal(dbapi_conn, connection_record):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.close()
+
+
+def _sqlite_db_path() -> str:
+    """Filesystem path of the app's SQLite DB (needs an app context)."""
+    path = db.engine.url.database
+    if db.engine.url.get_backend_name() != "sqlite" or not path or path == ":memory:":
+        raise RuntimeError("backups need a file-backed SQLite database")
+    return path
+
+
+def _list_backups() -> list[Path]:
+    """Newest first."""
+    try:
+        paths = [p for p in BACKUP_DIR.iterdir() if BACKUP_NAME_RE.match(p.name)]
+    except FileNotFoundError:
+        return []
+    def stamp(p: Path) -> tuple[str, str]:
+        m = BACKUP_NAME_RE.match(p.name)
+        return m.group(1), m.group(2) or "000000"
+
+    return sorted(paths, key=stamp, reverse=True)
+
+
+def run_db_backup(db_path: str, pages_per_step: int | None = None, step_sleep: float | None = None) -> dict | None:
+    """
+    Back up `db_path` into BACKUP_DIR, verify the copy with PRAGMA integrity_check,
+    then rotate down to BACKUP_KEEP files. pages_per_step <= 0 copies in one step.
+    Returns stats, or None when another thread/worker is already backing up.
+    Raises on failure (no partial file is left).
+    """
+    pages_per_step = BACKUP_PAGES_PER_STEP if pages_per_step is None else pages_per_step
+    step_sleep = BACKUP_STEP_SLEEP if step_sleep is None else step_sleep
+    if not _backup_lock.acquire(blocking=False):
+        return None
+    try:
+        with _file_lock(BACKUP_DIR / ".backup.lock", blocking=False) as acquired:
+            if not acquired:
+                return None
+            _backup_status["running"] = True
+            started = time.monotonic()
+            dest = BACKUP_DIR / f"{Path(db_path).stem}-{datetime.utcnow():%Y%m%dT%H%M%S.%fZ}.db"
+            tmp = dest.with_name(f".{dest.name}.tmp")
+            progress = {"steps": 0, "restarts": 0, "remaining": None, "pages": 0}
+
+            def on_step(status, remaining, total):
+                progress["steps"] += 1
+                progress["pages"] = total
+                restarted = progress["remaining"] is not None and remaining > progress["remaining"]
+                progress["remaining"] = None if restarted else remaining
+                if restarted:
+                    raise _BackupRestarted()
+                if remaining and step_sleep > 0:
+                    time.sleep(step_sleep)
+
+            try:
+                # as_uri() percent-encodes ?, # and % that would otherwise end the path
+                src = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+                dst = sqlite3.connect(tmp)
+                try:
+                    wal = src.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+                    if wal or pages_per_step <= 0:
+                        # WAL readers never block writers, so one step is a free consistent snapshot
+                        src.backup(dst, progress=on_step)
+                        mode = "snapshot" if wal else "single-step"
+                    else:
+                        mode = "stepped"
+                        while True:
+                            try:
+                                src.backup(dst, pages=pages_per_step, progress=on_step)
+                                break
+                            except _BackupRestarted:
+                                progress["restarts"] += 1
+                                if progress["restarts"] >= BACKUP_MAX_RESTARTS:
+                                    src.backup(dst)
+                                    mode = "single-step"
+                                    break
+                                pages_per_step *= 2
+                    check = dst.execute("PRAGMA integrity_check").fetchone()[0]
+                finally:
+                    dst.close()
+                    src.close()
+                if check != "ok":
+                    raise RuntimeError(f"backup integrity_check failed: {check}")
+                os.replace(tmp, dest)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+
+            removed = []
+            for old in _list_backups()[max(1, BACKUP_KEEP):]:
+                old.unlink(missing_ok=True)
+                removed.append(old.name)
+
+            stats = {
+                "file": dest.name,
+                "bytes": dest.stat().st_size,
+                "pages": progress["pages"],
+                "steps": progress["steps"],
+                "restarts": progress["restarts"],
+                "pagesPerStep": pages_per_step,
+                "mode": mode,
+                "integrity": check,
+                "rotated": removed,
+                "seconds": round(time.monotonic() - started, 3),
+            }
+            print("[backup]", stats)
+            return stats
+    finally:
+        _backup_status["running"] = False
+        _backup_lock.release()
+
+
+def _run_backup_recorded(db_path: str):
+    """run_db_backup for background threads: records the outcome for GET /admin/backups."""
+    try:
+        stats = run_db_backup(db_path)
+        if stats is not None:
+            _backup_status["last"] = {"ok": True, "finishedAt": datetime.utcnow().isoformat() + "Z", **stats}
+    except Exception as e:
+        print("[backup] failed:", e)
+        _backup_status["last"] = {"ok": False, "finishedAt": datetime.utcnow().isoformat() + "Z",
+                                  "error": f"{e.__class__.__name__}: {e}"}
+
+
+def _backup_loop(db_path: str):
+    while True:
+        time.sleep(BACKUP_INTERVAL)
+        # Every worker runs this loop; skip when another one backed up recently
+        latest = _list_backups()[:1]
+        if latest and time.time() - latest[0].stat().st_mtime < BACKUP_INTERVAL / 2:
+            continue
+        _run_backup_recorded(db_path)
+
+
+def start_backup_job(app: Flask):
+    """Start periodic backups when POS_BACKUP_INTERVAL > 0 (idempotent)."""
+    global _backup_thread
+    if BACKUP_INTERVAL <= 0 or _backup_thread is not None:
+        return
+    with app.app_context():
+        try:
+            db_path = _sqlite_db_path()
+        except RuntimeError as e:
+            print("[backup] job not started:", e)
+            return
+    _backup_thread = threading.Thread(target=_backup_loop, args=(db_path,), name="db-backup", daemon=True)
+    _backup_thread.start()
+
+
+@bp.cli.command("db-backup")
+def db_backup_command():
+    """Online backup of the SQLite DB into POS_BACKUP_DIR (verified + rotated)."""
+    stats = run_db_backup(_sqlite_db_path())
+    if stats is None:
+        print("[backup] another backup is already running")
+
+
+@bp.get("/admin/backups")
+@staff_required
+def admin_backups():
+    """Retained backups (newest first) plus the state of the last background run in this process."""
+    backups = []
+    for path in _list_backups():
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        backups.append({
+            "file": path.name,
+            "bytes": st.st_size,
+            "createdAt": datetime.utcfromtimestamp(st.st_mtime).isoformat() + "Z",
+        })
+    return jsonify({"ok": True, "running": _backup_status["running"], "last": _backup_status["last"],
+                    "backups": backups})
+
+
+@bp.post("/admin/backups")
+@staff_required
+def admin_start_backup():
+    """Start a backup in a background thread; poll GET /admin/backups for the result."""
+    if _backup_status["running"] or _backup_lock.locked():
+        return jsonify({"ok": False, "error": "Backup already running"}), 409
+    db_path = _sqlite_db_path()
+    audit(request.pp_user.id, "db_backup")
+    threading.Thread(target=_run_backup_recorded, args=(db_path,), name="db-backup-manual", daemon=True).start()
+    return jsonify({"ok": True, "started": True}), 202
+
+
+@bp.post("/register")
 def register():
     data = request.get_json() or {}
     ip = client_ip()
@@ -423,7 +1154,7 @@ def register():
         return jsonify({"ok": False, "error": "Server error"}), 500
 
 
-@app.route("/login", methods=["POST", "OPTIONS"])
+@bp.route("/login", methods=["POST", "OPTIONS"])
 def login():
     if request.method == "OPTIONS":
         return ("", 204)
@@ -491,7 +1222,7 @@ def login():
         return jsonify({"ok": False, "error": "Server error"}), 500
 
 
-@app.post("/auth/firebase")
+@bp.post("/auth/firebase")
 def auth_firebase():
     if not firebase_admin._apps:
         return jsonify({"ok": False, "error": "firebase-admin not configured"}), 500
@@ -550,21 +1281,25 @@ def auth_firebase():
     }), 200
 
 
-@app.get("/me")
-@auth_required
-def me():
-    u = request.pp_user
+def _me_payload(u) -> dict:
+    """{"user", "profile"} as returned by /me (and embedded in /public/bootstrap)."""
     profile = {}
     try:
         profile = json.loads(u.profile_json) if u.profile_json else {}
     except Exception:
         profile = {}
-    return jsonify({"ok": True, "user": {
+    return {"user": {
         "id": u.id, "phone": u.phone, "displayName": u.display_name, "role": u.role
-    }, "profile": profile})
+    }, "profile": profile}
 
 
-@app.put("/me")
+@bp.get("/me")
+@auth_required
+def me():
+    return jsonify({"ok": True, **_me_payload(request.pp_user)})
+
+
+@bp.put("/me")
 @auth_required
 def update_me():
     u = request.pp_user
@@ -581,17 +1316,10 @@ def update_me():
                 u.profile_json = u.profile_json
     u.updated_at = datetime.utcnow()
     db.session.commit()
-    profile = {}
-    try:
-        profile = json.loads(u.profile_json) if u.profile_json else {}
-    except Exception:
-        profile = {}
-    return jsonify({"ok": True, "user": {
-        "id": u.id, "phone": u.phone, "displayName": u.display_name, "role": u.role
-    }, "profile": profile})
+    return jsonify({"ok": True, **_me_payload(u)})
 
 
-@app.post("/auth/request-reset")
+@bp.post("/auth/request-reset")
 def request_reset():
     data = request.get_json() or {}
     ip = client_ip()
@@ -616,7 +1344,7 @@ def request_reset():
     return jsonify({"ok": True}), 200
 
 
-@app.post("/auth/reset")
+@bp.post("/auth/reset")
 def reset_password():
     data = request.get_json() or {}
     phone = (data.get("phone") or "").strip()
@@ -641,7 +1369,7 @@ def reset_password():
     return jsonify({"ok": True}), 200
 
 
-@app.get("/admin/users")
+@bp.get("/admin/users")
 @staff_required
 def admin_users():
     users = User.query.order_by(User.created_at.desc()).limit(500).all()
@@ -651,7 +1379,7 @@ def admin_users():
     ]})
 
 
-@app.patch("/admin/users/<int:user_id>")
+@bp.patch("/admin/users/<int:user_id>")
 @staff_required
 def admin_update_user(user_id: int):
     actor = request.pp_user
@@ -688,7 +1416,7 @@ def admin_update_user(user_id: int):
     return jsonify({"ok": True})
 
 
-@app.post("/admin/users/<int:user_id>/set-password")
+@bp.post("/admin/users/<int:user_id>/set-password")
 @staff_required
 def admin_set_password(user_id: int):
     u = User.query.get_or_404(user_id)
@@ -703,7 +1431,286 @@ def admin_set_password(user_id: int):
     return jsonify({"ok": True})
 
 
-@app.post("/admin/bootstrap")
+EXPORT_BATCH_SIZE = int(os.getenv("POS_EXPORT_BATCH_SIZE", "1000"))
+
+# (output field, column) pairs; hashes and profile blobs are never exported
+USER_EXPORT_COLUMNS = [
+    ("id", User.id),
+    ("phone", User.phone),
+    ("email", User.email),
+    ("displayName", User.display_name),
+    ("role", User.role),
+    ("isActive", User.is_active),
+    ("createdAt", User.created_at),
+    ("updatedAt", User.updated_at),
+    ("lastLoginAt", User.last_login_at),
+]
+AUDIT_EXPORT_COLUMNS = [
+    ("id", AdminAudit.id),
+    ("actorUserId", AdminAudit.actor_user_id),
+    ("targetUserId", AdminAudit.target_user_id),
+    ("action", AdminAudit.action),
+    ("detail", AdminAudit.detail),
+    ("ip", AdminAudit.ip),
+    ("createdAt", AdminAudit.created_at),
+]
+
+
+def _export_value(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# Only user-typed columns are neutralized; phone numbers (+61...) and other
+# server-formatted values must round-trip unchanged into downstream imports
+CSV_FREE_TEXT_COLUMNS = {"displayName", "email", "detail"}
+
+
+def _csv_cell(v):
+    """Neutralize user text that a spreadsheet would run as a formula (=HYPERLINK(...) etc.)."""
+    if isinstance(v, str) and v.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + v
+    return v
+
+
+def _stream_export(columns: list, key, basename: str):
+    """
+    Stream every row of `columns` as NDJSON (default) or CSV (?format=csv).
+    Rows are read in keyset batches on `key` (an integer primary key that is
+    one of `columns`) and each batch is flushed as one chunk, so memory stays
+    flat regardless of table size. Each batch is a short query whose read ends
+    before the chunk is sent, so a slow client never holds the SQLite read
+    lock (which would block every writer under the rollback journal).
+    """
+    fmt = (request.args.get("format") or "ndjson").strip().lower()
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"ok": False, "error": "format must be ndjson or csv"}), 400
+
+    names = [name for name, _ in columns]
+    key_index = next(i for i, (_, col) in enumerate(columns) if col is key)
+    free_text = [name in CSV_FREE_TEXT_COLUMNS for name in names]
+    stmt = select(*[col for _, col in columns]).order_by(key).limit(EXPORT_BATCH_SIZE)
+
+    def generate():
+        buf = io.StringIO()
+        writer = csv.writer(buf) if fmt == "csv" else None
+        if writer:
+            writer.writerow(names)
+        last = None
+        while True:
+            batch = db.session.execute(stmt if last is None else stmt.where(key > last)).all()
+            db.session.rollback()  # end the read transaction before the client sees the chunk
+            if not batch:
+                break
+            last = batch[-1][key_index]
+            for row in batch:
+                values = [_export_value(v) for v in row]
+                if writer:
+                    writer.writerow([_csv_cell(v) if text else v for v, text in zip(values, free_text)])
+                else:
+                    buf.write(json.dumps(dict(zip(names, values)), separators=(",", ":")))
+                    buf.write("\n")
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    resp = Response(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f'attachment; filename="{basename}.{fmt}"'
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+@bp.get("/admin/export/users")
+@staff_required
+def admin_export_users():
+    return _stream_export(USER_EXPORT_COLUMNS, User.id, "users")
+
+
+@bp.get("/admin/export/audit")
+@staff_required
+def admin_export_audit():
+    return _stream_export(AUDIT_EXPORT_COLUMNS, AdminAudit.id, "admin-audit")
+
+
+@bp.get("/admin/metrics")
+@staff_required
+def admin_metrics():
+    """Per-process load counters for monitoring (admission gates, menu breaker, order stream)."""
+    return jsonify({
+        "ok": True,
+        "pid": os.getpid(),
+        "admission": {name: gate.status() for name, gate in admission_gates.items()},
+        "menuBreaker": _menu_breaker.status(),
+        "orderStream": order_broker.status(),
+        "imageFlights": _image_flights.status(),
+        "missingImages": _missing_images.status(),
+    })
+
+
+@bp.get("/admin/profiles")
+@staff_required
+def admin_profiles():
+    """Newest-first summaries of the retained request profiles."""
+    profiles = []
+    for path in sorted(PROFILE_DIR.glob("*.json"), reverse=True):
+        try:
+            prof = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        profiles.append({
+            "id": prof["id"],
+            "trigger": prof.get("trigger"),
+            "method": prof.get("method"),
+            "path": prof.get("path"),
+            "status": prof.get("status"),
+            "startedAt": prof.get("started_at"),
+            "durationMs": prof.get("duration_ms"),
+            "sqlCount": len(prof.get("sql") or []),
+            "sqlMs": round(sum(q["duration_ms"] for q in prof.get("sql") or []), 3),
+            "upstreamMs": round(sum(u["duration_ms"] for u in prof.get("upstream") or []), 3),
+        })
+    return jsonify({"ok": True, "profiles": profiles})
+
+
+@bp.get("/admin/profiles/<profile_id>")
+@staff_required
+def admin_profile_download(profile_id: str):
+    """Full profile as JSON, or the raw cProfile dump with ?format=pstats (for snakeviz etc.)."""
+    if not PROFILE_ID_RE.match(profile_id):
+        return jsonify({"ok": False, "error": "not found"}), 404
+    ext = ".pstats" if request.args.get("format") == "pstats" else ".json"
+    if not (PROFILE_DIR / f"{profile_id}{ext}").is_file():
+        return jsonify({"ok": False, "error": "not found"}), 404
+    return send_from_directory(PROFILE_DIR, f"{profile_id}{ext}", as_attachment=ext == ".pstats")
+
+
+ADMIN_BULK_MAX_ITEMS = int(os.getenv("POS_ADMIN_BULK_MAX_ITEMS", "500"))
+# Each newPassword costs a full password hash (~100 ms); keep a batch well inside the worker timeout
+ADMIN_BULK_MAX_PASSWORDS = int(os.getenv("POS_ADMIN_BULK_MAX_PASSWORDS", "20"))
+
+
+@bp.post("/admin/users/bulk")
+@staff_required
+def admin_bulk_update_users():
+    """
+    Apply many user changes in one transaction.
+    Body: { "users": [ { "id", "displayName"?, "isActive"?, "role"?, "newPassword"? }, ... ] }
+    Invalid items are reported and skipped; the rest are written with one
+    executemany UPDATE, one audit INSERT batch and a single commit.
+    """
+    actor = request.pp_user
+    data = request.get_json() or {}
+    items = data.get("users")
+    if not isinstance(items, list) or not items:
+        return jsonify({"ok": False, "error": "Missing or invalid 'users'"}), 400
+    if len(items) > ADMIN_BULK_MAX_ITEMS:
+        return jsonify({"ok": False, "error": f"At most {ADMIN_BULK_MAX_ITEMS} users per request"}), 400
+    if sum(1 for item in items if isinstance(item, dict) and "newPassword" in item) > ADMIN_BULK_MAX_PASSWORDS:
+        return jsonify({"ok": False, "error": f"At most {ADMIN_BULK_MAX_PASSWORDS} password changes per request"}), 400
+
+    ids = set()
+    for item in items:
+        try:
+            ids.add(int(item.get("id")))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    current = {
+        row.id: row
+        for row in db.session.execute(
+            select(User.id, User.display_name, User.is_active, User.role).where(User.id.in_(ids))
+        )
+    }
+
+    now = datetime.utcnow()
+    results = []
+    updates = []
+    audits = []
+    seen = set()
+    for item in items:
+        try:
+            user_id = int(item.get("id"))
+        except (AttributeError, TypeError, ValueError):
+            results.append({"id": None, "ok": False, "error": "Missing or invalid id"})
+            continue
+        if user_id in seen:
+            results.append({"id": user_id, "ok": False, "error": "Duplicate id"})
+            continue
+        seen.add(user_id)
+        u = current.get(user_id)
+        if u is None:
+            results.append({"id": user_id, "ok": False, "error": "not found"})
+            continue
+
+        values = {}
+        changes = []
+        if "displayName" in item:
+            new_display_name = (item.get("displayName") or "").strip()
+            if new_display_name != u.display_name:
+                changes.append(f"displayName:{u.display_name}->{new_display_name}")
+            values["display_name"] = new_display_name
+
+        if "isActive" in item:
+            new_is_active = bool(item.get("isActive"))
+            if new_is_active != u.is_active:
+                changes.append(f"isActive:{u.is_active}->{new_is_active}")
+            values["is_active"] = new_is_active
+
+        if "role" in item:
+            if actor.role != "admin":
+                results.append({"id": user_id, "ok": False, "error": "Forbidden"})
+                continue
+            role = (item.get("role") or "").strip()
+            if role not in ("customer", "staff", "admin"):
+                results.append({"id": user_id, "ok": False, "error": "Invalid role"})
+                continue
+            if role != u.role:
+                changes.append(f"role:{u.role}->{role}")
+            values["role"] = role
+
+        if "newPassword" in item:
+            pw = item.get("newPassword") or ""
+            if len(pw) < 6:
+                results.append({"id": user_id, "ok": False, "error": "Password must be at least 6 characters"})
+                continue
+            values["password_hash"] = generate_password_hash(pw)
+
+        if not values:
+            results.append({"id": user_id, "ok": True, "changes": []})
+            continue
+
+        values["id"] = user_id
+        values["updated_at"] = now
+        updates.append(values)
+        if changes:
+            audits.append(_audit_row(actor.id, "update_user", target_id=user_id, detail="; ".join(changes)))
+        if "password_hash" in values:
+            audits.append(_audit_row(actor.id, "set_password", target_id=user_id))
+            changes.append("password")
+        results.append({"id": user_id, "ok": True, "changes": changes})
+
+    try:
+        if updates:
+            db.session.execute(update(User), updates)
+        if audits:
+            db.session.execute(insert(AdminAudit), audits)
+        db.session.commit()
+    except Exception as e:
+        print("[admin] bulk update failed:", e)
+        db.session.rollback()
+        return jsonify({"ok": False, "error": "Database error. Try again."}), 500
+
+    return jsonify({
+        "ok": True,
+        "updated": len(updates),
+        "failed": sum(1 for r in results if not r["ok"]),
+        "results": results,
+    })
+
+
+@bp.post("/admin/bootstrap")
 def admin_bootstrap():
     if IS_PROD and os.getenv("POS_ALLOW_BOOTSTRAP_IN_PROD", "0") != "1":
         return jsonify({"ok": False, "error": "Forbidden"}), 403
@@ -791,53 +1798,192 @@ def _normalize_to_minimal_catalog(payload: dict) -> dict:
     return {"data": {"categories": categories, "products": products}}
 
 
-@app.get("/public/menu")
-def public_menu():
+class CircuitBreaker:
     """
-    Frontend expects: GET /public/menu -> 200 + { data: { categories, products } }
-    Return helpful JSON on failure.
+    Per-process breaker: closed until `failure_threshold` consecutive failures,
+    then open for `cooldown` seconds, then half-open, letting a single probe
+    through. The probe's outcome closes or re-opens the breaker. A probe whose
+    outcome is never recorded (e.g. the request was shed after asgi.py claimed
+    the slot) expires after `cooldown`, and the next caller probes again.
     """
-    try:
-        # 1) Prefer live menu via POS_MENU_URL (key optional)
-        pos_key = (os.getenv("POS_API_KEY") or "").strip()
-        pos_url = (os.getenv("POS_MENU_URL") or "").strip()
 
-        raw = None
-        if pos_url:
+    def __init__(self, name: str, failure_threshold: int, cooldown: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == "closed":
+                return True
+            now = time.monotonic()
+            if self._state == "open" and now - self._opened_at >= self.cooldown:
+                self._state = "half_open"
+                self._probe_at = now
+                return True
+            if self._state == "half_open" and now - self._probe_at >= self.cooldown:
+                self._probe_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != "closed":
+                print(f"[breaker] {self.name} closed")
+            self._state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    print(f"[breaker] {self.name} open after {self._failures} failure(s)")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"state": self._state, "failures": self._failures}
+
+
+_menu_breaker = CircuitBreaker(
+    "menu",
+    failure_threshold=int(os.getenv("POS_MENU_BREAKER_FAILURES", "3")),
+    cooldown=float(os.getenv("POS_MENU_BREAKER_COOLDOWN", "30")),
+)
+
+# Last successfully fetched upstream menu, persisted so it survives restarts
+MENU_SNAPSHOT_PATH = Path(os.getenv("POS_MENU_SNAPSHOT_PATH", str(DB_DIR / "menu_snapshot.json")))
+_menu_snapshot_lock = threading.Lock()
+_menu_snapshot: dict | None = None
+_menu_snapshot_loaded = False
+
+
+def _load_menu_snapshot() -> dict | None:
+    """{"fetched_at": iso str, "catalog": {...}} or None."""
+    global _menu_snapshot, _menu_snapshot_loaded
+    with _menu_snapshot_lock:
+        if not _menu_snapshot_loaded:
+            _menu_snapshot_loaded = True
             try:
-                headers = {"Accept": "application/json"}
-                if pos_key:
-                    # send both header casings + bearer (covers most servers)
-                    headers["X-API-Key"] = pos_key
-                    headers["x-api-key"] = pos_key
-                    headers["Authorization"] = f"Bearer {pos_key}"
-
-                res = requests.get(pos_url, headers=headers, timeout=12)
-                if res.ok:
-                    raw = res.json()
-                else:
-                    return jsonify({
-                        "error": "Upstream menu fetch failed",
-                        "upstream_status": res.status_code,
-                        "upstream_body": (res.text or "")[:200],
-                        "pos_url": pos_url,
-                    }), 502
+                with MENU_SNAPSHOT_PATH.open("r", encoding="utf-8") as f:
+                    snap = json.load(f)
+                if isinstance(snap, dict) and isinstance(snap.get("catalog"), dict):
+                    _menu_snapshot = snap
+            except FileNotFoundError:
+                pass
             except Exception as e:
-                return jsonify({
-                    "error": "Upstream menu fetch exception",
+                print("[menu] ignoring unreadable snapshot:", e)
+        return _menu_snapshot
+
+
+def _save_menu_snapshot(catalog: dict):
+    global _menu_snapshot, _menu_snapshot_loaded
+    current = _load_menu_snapshot()
+    snap = {"fetched_at": datetime.utcnow().isoformat(timespec="seconds") + "Z", "catalog": catalog}
+    with _menu_snapshot_lock:
+        _menu_snapshot, _menu_snapshot_loaded = snap, True
+    # Only touch the disk when the menu actually changed
+    if current is not None and current.get("catalog") == catalog:
+        return
+    try:
+        atomic_write_bytes(MENU_SNAPSHOT_PATH, json.dumps(snap).encode("utf-8"))
+    except Exception as e:
+        print("[menu] failed to persist snapshot:", e)
+
+
+class MenuUnavailable(Exception):
+    """Upstream menu failed and there is no snapshot to fall back on."""
+
+    def __init__(self, payload: dict, status: int = 502):
+        super().__init__(payload.get("error", "menu unavailable"))
+        self.payload = payload
+        self.status = status
+
+
+def _menu_catalog_is_valid(out: dict) -> bool:
+    data = out.get("data", {})
+    return isinstance(data.get("categories"), list) and isinstance(data.get("products"), list)
+
+
+def _resolve_menu() -> tuple[dict, dict]:
+    """
+    Return (catalog, meta) for the current menu.
+    Live POS_MENU_URL fetches go through _menu_breaker; when the upstream
+    fails or the breaker is open, the last good snapshot is returned with
+    meta["stale"] set. Raises MenuUnavailable when there is nothing to serve.
+    """
+    upstream = _menu_upstream_request()
+    if not upstream:
+        # Fallback to local file(s) when live fetch is unavailable
+        return _normalize_to_minimal_catalog(_load_menu_json()), {"source": "file", "stale": False}
+
+    pos_url, headers = upstream
+    res = _prefetched_upstream(pos_url)
+    if res is None and _menu_breaker.allow():
+        res = _upstream_get(pos_url, headers)
+
+    if res is None:
+        failure = {"error": "Upstream menu circuit open", "pos_url": pos_url}
+    else:
+        try:
+            if res["error"]:
+                raise RuntimeError(res["error"])
+            if not 200 <= res["status"] < 400:
+                failure = {
+                    "error": "Upstream menu fetch failed",
+                    "upstream_status": res["status"],
+                    "upstream_body": res["body"].decode("utf-8", "replace")[:200],
                     "pos_url": pos_url,
-                    "detail": f"{e.__class__.__name__}: {e}",
-                }), 502
+                }
+            else:
+                out = _normalize_to_minimal_catalog(json.loads(res["body"]))
+                if not _menu_catalog_is_valid(out):
+                    raise ValueError("Menu payload missing categories/products list.")
+                _menu_breaker.record_success()
+                _save_menu_snapshot(out)
+                return out, {"source": "upstream", "stale": False}
+        except Exception as e:
+            failure = {
+                "error": "Upstream menu fetch exception",
+                "pos_url": pos_url,
+                "detail": res["error"] or f"{e.__class__.__name__}: {e}",
+            }
+        _menu_breaker.record_failure()
+
+    snap = _load_menu_snapshot()
+    if snap:
+        return snap["catalog"], {"source": "snapshot", "stale": True, "fetched_at": snap.get("fetched_at")}
+    raise MenuUnavailable(failure)
 
-        # 2) Fallback to local file(s) when live fetch is unavailable
-        if raw is None:
-            raw = _load_menu_json()
 
-        out = _normalize_to_minimal_catalog(raw)
-        data = out.get("data", {})
-        if not isinstance(data.get("categories"), list) or not isinstance(data.get("products"), list):
+@bp.get("/public/menu")
+def public_menu():
+    """
+    Frontend expects: GET /public/menu -> 200 + { data: { categories, products } }
+    Stale snapshots are flagged with X-Menu-Stale / X-Menu-Snapshot-At.
+    Return helpful JSON on failure.
+    """
+    try:
+        out, meta = _resolve_menu()
+        if not _menu_catalog_is_valid(out):
             return jsonify({"error": "Menu payload missing categories/products list."}), 500
-        return jsonify(out), 200
+        state = _publish_menu(out, meta)
+        resp = Response(state.body, mimetype="application/json")
+        resp.headers["X-Menu-Version"] = state.version
+        if meta["stale"]:
+            resp.headers["X-Menu-Stale"] = "1"
+            resp.headers["X-Menu-Snapshot-At"] = meta.get("fetched_at") or ""
+            resp.headers["Cache-Control"] = "no-store"
+        return resp, 200
+    except MenuUnavailable as e:
+        return jsonify(e.payload), e.status
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 500
     except json.JSONDecodeError:
@@ -846,7 +1992,381 @@ def public_menu():
         return jsonify({"error": f"Unexpected server error: {e.__class__.__name__}: {e}"}), 500
 
 
-@app.route("/api/orders", methods=["POST", "OPTIONS"])
+# --- Menu versions + search ---
+# A menu version is the content hash of the normalized catalog. Everything
+# derived from a version (serialized body, search index) is built once and
+# reused until the catalog changes.
+MENU_CACHE_SECONDS = float(os.getenv("POS_MENU_CACHE_SECONDS", "30"))
+MENU_SEARCH_MAX_LIMIT = 100
+MENU_SEARCH_FIELD_WEIGHTS = {"name": 3.0, "category": 1.5, "description": 1.0}
+_SEARCH_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def _search_tokens(text) -> list[str]:
+    """Lowercased, accent-stripped word tokens ("Jalapeño Poppers" -> ["jalapeno", "poppers"])."""
+    s = unicodedata.normalize("NFKD", str(text or ""))
+    s = "".join(ch for ch in s if not unicodedata.combining(ch)).casefold()
+    return _SEARCH_WORD_RE.findall(s)
+
+
+class MenuSearchIndex:
+    """
+    Inverted index over product names, descriptions and category names for one
+    menu version. A query token matches vocabulary terms exactly, by prefix
+    (bisect over the sorted vocabulary) or with typos: from TYPO_MIN_LEN chars
+    on within one edit, from TYPO2_MIN_LEN chars on within two, of either a
+    whole term or a term's prefix ("margarita" and "margar" both find
+    "margherita"). Typos are found by walking a trie of the vocabulary with
+    Damerau-Levenshtein rows, pruning branches already over budget.
+    Every query token has to match (AND); scores add up field weights scaled
+    by match quality.
+    """
+
+    TYPO_MIN_LEN = 4
+    TYPO2_MIN_LEN = 6
+    EXACT, PREFIX, TYPO, TYPO_PREFIX = 1.0, 0.7, 0.5, 0.4
+
+    def __init__(self, catalog: dict):
+        data = catalog.get("data") or {}
+        categories = {}
+        for c in data.get("categories") or []:
+            if isinstance(c, dict):
+                categories[str(c.get("ref") or c.get("id") or "").upper()] = c.get("name") or ""
+
+        postings = defaultdict(dict)  # term -> {product index: weight}
+        self.ids = []
+        self._name_len = []
+        for i, p in enumerate(data.get("products") or []):
+            p = p if isinstance(p, dict) else {}
+            self.ids.append(p.get("id", p.get("ref")))
+            self._name_len.append(len(str(p.get("name") or "")))
+            fields = {
+                "name": p.get("name"),
+                "description": p.get("description"),
+                "category": categories.get(str(p.get("category_ref") or p.get("categoryRef") or "").upper()),
+            }
+            for field, text in fields.items():
+                for term in set(_search_tokens(text)):
+                    postings[term][i] = postings[term].get(i, 0.0) + MENU_SEARCH_FIELD_WEIGHTS[field]
+
+        self._postings = dict(postings)
+        self._terms = sorted(self._postings)
+        self._trie = {}  # char -> child node; the None key marks a node that ends a term
+        for term in self._terms:
+            node = self._trie
+            for ch in term:
+                node = node.setdefault(ch, {})
+            node[None] = term
+
+    def _typo_terms(self, tok: str, max_edits: int) -> dict[str, float]:
+        """
+        Terms within max_edits of tok (TYPO), or whose prefix is (TYPO_PREFIX).
+        Only terms sharing tok's first letter get more than one edit, which keeps
+        the walk from visiting most of the trie's top levels.
+        """
+        n = len(tok)
+        found = {}
+        prefixes = []
+        path = []
+
+        # One edit-distance row per trie node (optimal string alignment, so an
+        # adjacent swap costs one edit), computed only inside the band that can
+        # still be within `budget`; recursion depth is the longest term.
+        def walk(node, prev2, prev, prev_ch, budget, covered):
+            depth = len(path) + 1
+            over = budget + 1
+            lo, hi = max(1, depth - budget), min(n, depth + budget)
+            for ch, child in node.items():
+                if ch is None:
+                    continue
+                row = [over] * (n + 1)
+                row[0] = depth if depth <= budget else over
+                best = row[0]
+                for j in range(lo, hi + 1):
+                    d = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + (tok[j - 1] != ch))
+                    if j > 1 and prev2 is not None and tok[j - 1] == prev_ch and tok[j - 2] == ch:
+                        d = min(d, prev2[j - 2] + 1)
+                    row[j] = d
+                    best = min(best, d)
+                if best > budget:
+                    continue
+                path.append(ch)
+                hit = row[n] <= budget
+                if hit and None in child:
+                    found[child[None]] = self.TYPO
+                # A much shorter prefix would only match by dropping tok's tail
+                prefix_hit = hit and depth >= n - 1
+                if prefix_hit and not covered:
+                    prefixes.append("".join(path))
+                walk(child, prev, row, ch, budget, covered or prefix_hit)
+                path.pop()
+
+        root = list(range(n + 1))
+        for ch, child in self._trie.items():
+            if ch is not None:
+                walk({ch: child}, None, root, None, max_edits if ch == tok[0] else min(max_edits, 1), False)
+        for p in prefixes:
+            lo = bisect.bisect_left(self._terms, p)
+            hi = bisect.bisect_left(self._terms, p + "\U0010ffff", lo)
+            for term in self._terms[lo:hi]:
+                found.setdefault(term, self.TYPO_PREFIX)
+        return found
+
+    def _match(self, tok: str) -> dict[int, float]:
+        scores = {}
+
+        def add(term: str, factor: float):
+            for i, w in self._postings[term].items():
+                if w * factor > scores.get(i, 0.0):
+                    scores[i] = w * factor
+
+        lo = bisect.bisect_left(self._terms, tok)
+        hi = bisect.bisect_left(self._terms, tok + "\U0010ffff", lo)
+        for term in self._terms[lo:hi]:
+            add(term, self.EXACT if term == tok else self.PREFIX)
+        if len(tok) >= self.TYPO_MIN_LEN:
+            max_edits = 2 if len(tok) >= self.TYPO2_MIN_LEN else 1
+            for term, factor in self._typo_terms(tok, max_edits).items():
+                if not term.startswith(tok):
+                    add(term, factor)
+        return scores
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> tuple[int, list[tuple[int, float]]]:
+        """(total matches, [(product index, score)] for the requested page), best first."""
+        combined = None
+        for tok in dict.fromkeys(_search_tokens(query)[:8]):
+            m = self._match(tok)
+            combined = m if combined is None else {i: s + m[i] for i, s in combined.items() if i in m}
+            if not combined:
+                return 0, []
+        if not combined:
+            return 0, []
+        ranked = sorted(combined.items(), key=lambda kv: (-kv[1], self._name_len[kv[0]], kv[0]))
+        return len(ranked), ranked[offset:offset + limit]
+
+
+class MenuState:
+    """One resolved menu version: the catalog, its serialized body and (lazily) its search index."""
+
+    def __init__(self, catalog: dict, meta: dict):
+        self.catalog = catalog
+        self.meta = meta
+        self.body = json.dumps(catalog, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        self.version = hashlib.sha256(self.body).hexdigest()[:16]
+        self.loaded_at = time.monotonic()
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def index(self) -> MenuSearchIndex:
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    t0 = time.perf_counter()
+                    self._index = MenuSearchIndex(self.catalog)
+                    print(f"[menu] search index for {self.version} built in "
+                          f"{(time.perf_counter() - t0) * 1000:.1f} ms")
+        return self._index
+
+
+_menu_state: MenuState | None = None
+_menu_state_lock = threading.Lock()
+_menu_refresh_lock = threading.Lock()
+
+
+def _publish_menu(catalog: dict, meta: dict) -> MenuState:
+    """Record a freshly resolved catalog; keeps the existing state (and its index) when the version is unchanged."""
+    global _menu_state
+    state = MenuState(catalog, meta)
+    with _menu_state_lock:
+        current = _menu_state
+        if current is not None and current.version == state.version:
+            current.meta = meta
+            current.loaded_at = state.loaded_at
+            return current
+        _menu_state = state
+    print(f"[menu] version {state.version} ({meta.get('source')})")
+    return state
+
+
+def _current_menu() -> MenuState:
+    """
+    Cached MenuState, re-resolved at most every MENU_CACHE_SECONDS (public_menu
+    refreshes it too). While one thread refreshes, the others keep serving the
+    previous version. Raises what _resolve_menu() raises when there is none.
+    """
+    state = _menu_state
+    if state is not None and time.monotonic() - state.loaded_at < MENU_CACHE_SECONDS:
+        return state
+    if not _menu_refresh_lock.acquire(blocking=state is None):
+        return state
+    try:
+        state = _menu_state
+        if state is not None and time.monotonic() - state.loaded_at < MENU_CACHE_SECONDS:
+            return state
+        catalog, meta = _resolve_menu()
+        if not _menu_catalog_is_valid(catalog):
+            raise MenuUnavailable({"error": "Menu payload missing categories/products list."}, 500)
+        return _publish_menu(catalog, meta)
+    finally:
+        _menu_refresh_lock.release()
+
+
+@bp.get("/public/menu/search")
+def public_menu_search():
+    """
+    GET /public/menu/search?q=marg&offset=0&limit=20
+    -> { ok, version, total, results: [{ index, id, score }] }
+    `index` points into data.products of the menu with that version (see the
+    X-Menu-Version header on /public/menu); `id` is the product's own id/ref, if any.
+    """
+    q = (request.args.get("q") or "").strip()[:100]
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+        limit = min(MENU_SEARCH_MAX_LIMIT, max(1, int(request.args.get("limit", 20))))
+    except ValueError:
+        return jsonify({"ok": False, "error": "offset/limit must be integers"}), 400
+
+    try:
+        state = _current_menu()
+    except MenuUnavailable as e:
+        return jsonify(e.payload), e.status
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Menu unavailable: {e.__class__.__name__}: {e}"}), 500
+
+    index = state.index
+    total, page = index.search(q, offset, limit)
+    resp = jsonify({
+        "ok": True,
+        "version": state.version,
+        "stale": bool(state.meta.get("stale")),
+        "q": q,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "results": [{"index": i, "id": index.ids[i], "score": round(score, 3)} for i, score in page],
+    })
+    resp.headers["X-Menu-Version"] = state.version
+    return resp
+
+
+class OrderBroker:
+    """
+    Fan-out of accepted orders to the staff displays of every worker process.
+    publish() appends the order to the order_event table; each process runs
+    one tail thread (start()) that reads rows past its cursor every `poll`
+    seconds, or at once for orders published by the same process, and hands
+    them to local waiters and subscribers. Event ids are the row ids, so a
+    display can resume with Last-Event-ID on any worker or after a restart;
+    the last `backlog` events stay in memory for that.
+    """
+
+    def __init__(self, backlog: int = 200, poll: float = 0.5, keep: int = 1000):
+        self.backlog = backlog
+        self.poll = poll
+        self.keep = max(keep, backlog)
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=backlog)
+        self._seq = 0
+        self._listeners = set()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def publish(self, payload: dict) -> str:
+        """Persist an accepted order (needs an app context) and return its event id."""
+        row = OrderEvent(data=json.dumps(payload, separators=(",", ":")))
+        db.session.add(row)
+        db.session.commit()
+        if row.id % 100 == 0:
+            db.session.execute(delete(OrderEvent).where(OrderEvent.id <= row.id - self.keep))
+            db.session.commit()
+        self._wake.set()
+        return str(row.id)
+
+    def start(self, app: Flask):
+        """Start this process's tail thread (idempotent), primed with the last `backlog` events."""
+        if self._thread is not None:
+            return
+        with app.app_context():
+            latest = db.session.execute(select(func.max(OrderEvent.id))).scalar() or 0
+        self._seq = max(0, latest - self.backlog)
+        self._thread = threading.Thread(target=self._tail, args=(app,), name="order-tail", daemon=True)
+        self._thread.start()
+
+    def _tail(self, app: Flask):
+        while True:
+            try:
+                with app.app_context():
+                    rows = db.session.execute(
+                        select(OrderEvent.id, OrderEvent.data)
+                        .where(OrderEvent.id > self._seq)
+                        .order_by(OrderEvent.id)
+                        .limit(self.backlog)
+                    ).all()
+            except Exception as e:
+                print("[orders] stream tail failed:", e)
+                rows = []
+            for row_id, data in rows:
+                self._ingest({"seq": row_id, "id": str(row_id), "data": data})
+            if len(rows) < self.backlog:
+                self._wake.wait(self.poll)
+                self._wake.clear()
+
+    def _ingest(self, ev: dict):
+        with self._cond:
+            self._events.append(ev)
+            self._seq = ev["seq"]
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(ev)
+            except Exception as e:
+                print("[orders] stream listener failed:", e)
+
+    def _after(self, seq: int) -> list[dict]:
+        return [ev for ev in self._events if ev["seq"] > seq]
+
+    def since(self, last_event_id: str | None) -> tuple[list[dict], int]:
+        """(events after last_event_id, cursor to wait from). No id = live events only."""
+        with self._cond:
+            if not last_event_id:
+                return [], self._seq
+            if not last_event_id.isdigit():
+                return self._after(0), self._seq
+            # An id this process has not tailed yet came from a faster worker: skip to it
+            seq = int(last_event_id)
+            return self._after(seq), max(seq, self._seq)
+
+    def wait(self, seq: int, timeout: float) -> tuple[list[dict], int]:
+        """Block up to `timeout` for events after `seq`; returns (events, new seq)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout=timeout)
+            return self._after(seq), max(seq, self._seq)
+
+    def subscribe(self, listener):
+        """Call listener(event) from the tail thread for each new event (used by asgi.py)."""
+        with self._cond:
+            self._listeners.add(listener)
+
+    def unsubscribe(self, listener):
+        with self._cond:
+            self._listeners.discard(listener)
+
+    def status(self) -> dict:
+        with self._cond:
+            return {"seq": self._seq, "buffered": len(self._events), "listeners": len(self._listeners),
+                    "tailing": self._thread is not None}
+
+
+order_broker = OrderBroker(
+    backlog=int(os.getenv("POS_ORDER_STREAM_BACKLOG", "200")),
+    poll=float(os.getenv("POS_ORDER_STREAM_POLL_SECONDS", "0.5")),
+    keep=int(os.getenv("POS_ORDER_EVENT_KEEP", "1000")),
+)
+
+
+@bp.route("/api/orders", methods=["POST", "OPTIONS"])
 def api_orders():
     if request.method == "OPTIONS":
         return ("", 204)
@@ -879,14 +2399,95 @@ def api_orders():
             }
         }), 400
 
+    received_at = int(time.time())
+    order_broker.publish({
+        "received_at": received_at,
+        "client_order_id": payload.get("client_order_id"),
+        "line_count": len(lines),
+        "order": payload,
+    })
     return jsonify({
         "ok": True,
-        "received_at": int(time.time()),
+        "received_at": received_at,
         "client_order_id": payload.get("client_order_id"),
         "line_count": len(lines),
     }), 201
 
 
+def staff_user_for_token(tok: str | None):
+    """Staff/admin User for a raw token, or None. Needs an app context, not a request."""
+    u = user_from_bearer(tok) if tok else None
+    return u if u and u.role in ("staff", "admin") else None
+
+
+def origin_allowed(origin: str) -> bool:
+    """Same origin rules CORS() is configured with (exact strings or ^regex$ entries)."""
+    for o in ALLOWED_ORIGINS:
+        if o == origin or (o.startswith("^") and re.match(o, origin)):
+            return True
+    return False
+
+
+def _sse_event(ev: dict) -> str:
+    return f"id: {ev['id']}\nevent: order\ndata: {ev['data']}\n\n"
+
+
+ORDER_STREAM_MAX_SECONDS = float(os.getenv("POS_ORDER_STREAM_MAX_SECONDS", "50"))
+ORDER_STREAM_HEARTBEAT_SECONDS = 15
+# Under WSGI every open stream pins a request thread, so only a small share of
+# them may stream at once (0 = refuse). Over the cap the display gets a fast
+# 503 + Retry-After, never a queue. Deployments with more than a display or two
+# per worker serve the stream from asgi.py (see gunicorn.conf.py).
+ORDER_STREAM_WSGI_LIMIT = int(os.getenv("POS_ORDER_STREAM_WSGI_LIMIT", str(WORKER_THREADS // 4)))
+ORDER_STREAM_RETRY_SECONDS = 10
+# A vanished client is only noticed when a write fails (usually the second one
+# after it left), so WSGI streams keep alive more often to free the slot sooner
+ORDER_STREAM_WSGI_KEEPALIVE_SECONDS = 5
+admission_gates["stream"] = AdmissionGate("stream", max(0, ORDER_STREAM_WSGI_LIMIT), 0, 0)
+admission_gates["stream"].retry_after = ORDER_STREAM_RETRY_SECONDS
+
+
+@bp.get("/staff/orders/stream")
+def staff_orders_stream():
+    """
+    Server-Sent Events feed of accepted orders for kitchen/staff displays.
+    Auth: staff bearer token, or ?token= (EventSource cannot send headers).
+    Resumes after Last-Event-ID (header or ?lastEventId=). Under WSGI each
+    connection holds a worker thread, so at most POS_ORDER_STREAM_WSGI_LIMIT
+    streams run per process and each ends after POS_ORDER_STREAM_MAX_SECONDS
+    (EventSource reconnects); the rest get a 503 with Retry-After:
+    ORDER_STREAM_RETRY_SECONDS (10). The ASGI entry point (asgi.py), the
+    supported way to run kitchen displays, streams natively without either limit.
+    """
+    if not staff_user_for_token(get_bearer_token() or request.args.get("token")):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    gate = admission_gates["stream"]
+    if gate.limit <= 0 or not gate.try_enter():
+        return _shed_response(gate, "Order stream busy; retry later or serve displays via asgi.py")
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+
+    def generate():
+        deadline = time.monotonic() + ORDER_STREAM_MAX_SECONDS
+        yield "retry: 3000\n\n"
+        pending, seq = order_broker.since(last_event_id)
+        while True:
+            for ev in pending:
+                yield _sse_event(ev)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            pending, seq = order_broker.wait(seq, min(remaining, ORDER_STREAM_WSGI_KEEPALIVE_SECONDS))
+            if not pending:
+                yield ": keepalive\n\n"
+
+    resp = Response(generate(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    # The server closes the response iterable when the stream ends or the client goes away
+    resp.call_on_close(gate.leave)
+    return resp
+
+
 # 👇 Move this ABOVE the "if __name__ == '__main__':" line (already is)
 # Helper utilities for resilient image lookup
 def _norm_key(stem: str) -> str:
@@ -924,44 +2525,484 @@ def _pick_best_match(request_stem: str, files: list[str]) -> str | None:
     return candidates[0]
 
 
-def _list_images_payload() -> dict:
-    """Return a JSON-friendly listing of available image files."""
-    dirs = [d for d in UPLOAD_DIRS if d.is_dir()]
-    if not dirs:
-        return {"ok": True, "images": []}
+def _find_local_image(safe: str, fuzzy: bool = True) -> tuple[Path, str] | None:
+    """(directory, filename) of a local match for `safe`, or None."""
+    # 1) Try direct file in our upload dirs (persistent first, then repo bundled)
+    for d in UPLOAD_DIRS:
+        if (d / safe).is_file():
+            return d, safe
+    if not fuzzy:
+        return None
 
-    images = []
-    seen = set()
-    for d in dirs:
-        for name in sorted(os.listdir(d)):
-            ext = Path(name).suffix.lower()
-            if ext not in {".jpg", ".jpeg", ".png", ".webp"}:
-                continue
-            if name in seen:
-                continue
-            seen.add(name)
-            images.append({"filename": name, "url": f"/api/images/{name}"})
-    return {"ok": True, "images": images}
+    # 2) Try fuzzy match across upload dirs
+    req_stem = Path(safe).stem
+    for d in UPLOAD_DIRS:
+        try:
+            files = os.listdir(d)
+        except Exception:
+            continue
+
+        alt = _pick_best_match(req_stem, files)
+        if alt:
+            return d, alt
+    return None
+
+
+class SingleFlight:
+    """
+    Per-key call coalescing: while do(key, fn) runs for a key, concurrent callers
+    with the same key wait and get the same result (or exception) instead of
+    running fn again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"inFlight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+_image_flights = SingleFlight()
+# Cross-worker coordination uses a fixed set of striped lock files, so filenames
+# from scanners can't grow the lock dir without bound
+IMAGE_FETCH_LOCK_DIR = PERSIST_UPLOAD_DIR / ".locks"
+IMAGE_FETCH_LOCK_STRIPES = 64
+
+
+def _persist_upstream_image(safe: str, r: dict) -> bool:
+    """Keep a successful upstream image in PERSIST_UPLOAD_DIR so later requests (any worker) hit locally."""
+    if r["status"] != 200 or not r["body"] or Path(safe).suffix.lower() not in IMAGE_EXTS:
+        return False
+    if not (r["content_type"] or "").lower().startswith("image/"):
+        return False
+    try:
+        atomic_write_bytes(PERSIST_UPLOAD_DIR / safe, r["body"])
+        return True
+    except OSError as e:
+        print(f"[images] could not persist {safe}: {e}")
+        return False
 
 
-@app.route("/public/images", methods=["GET"])
+def _fetch_image_upstream(safe: str, upstream: tuple[str, dict]) -> dict | None:
+    """
+    Leader side of an image miss: one upstream fetch per filename per process
+    (via _image_flights), and per lock stripe across workers. Returns the
+    upstream result, or None when another worker landed the file while we
+    waited for its lock.
+    """
+    stripe = zlib.crc32(safe.encode("utf-8")) % IMAGE_FETCH_LOCK_STRIPES
+    with admission_gates["upstream"].admit():
+        with _file_lock(IMAGE_FETCH_LOCK_DIR / f"image-{stripe:02d}.lock"):
+            if (PERSIST_UPLOAD_DIR / safe).is_file():
+                return None
+            r = _upstream_get(*upstream)
+            _persist_upstream_image(safe, r)
+            return r
+
+
+class MissingImageCache:
+    """
+    Bounded TTL LRU of filenames known to be missing: not in any upload dir,
+    not fuzzy-matchable, and not on upstream (404/410 or no upstream configured).
+    Cleared whenever the upload dirs' signature changes (a file landed, from
+    any worker) and after an image sync.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # name -> expires_at (monotonic)
+        self._signature = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _clear(self):
+        self._entries.clear()
+        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def contains(self, name: str, count: bool = True) -> bool:
+        """`count=False` for pre-checks (asgi.py) that the Flask view will repeat."""
+        if self.max_entries <= 0:
+            return False
+        sig = _upload_dirs_signature()
+        now = time.monotonic()
+        with self._lock:
+            if sig != self._signature:
+                self._signature = sig
+                if self._entries:
+                    self._clear()
+            expires_at = self._entries.get(name)
+            if expires_at is not None and expires_at > now:
+                self._entries.move_to_end(name)
+                self.hits += count
+                return True
+            if expires_at is not None:
+                del self._entries[name]
+            self.misses += count
+            return False
+
+    def add(self, name: str):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[name] = time.monotonic() + self.ttl
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+_missing_images = MissingImageCache(
+    max_entries=int(os.getenv("POS_MISSING_IMAGE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("POS_MISSING_IMAGE_TTL", "300")),
+)
+
+
+def _images_list_url() -> str:
+    # Listing endpoint used by tools/sync_images_from_render.ps1; override with POS_IMAGES_LIST_URL
+    explicit = (os.getenv("POS_IMAGES_LIST_URL") or "").strip()
+    if explicit:
+        return explicit
+    base = (os.getenv("POS_BASE_URL") or "").strip().rstrip("/")
+    return f"{base}/api/images/" if base else ""
+
+
+IMAGE_SYNC_INTERVAL = float(os.getenv("POS_IMAGE_SYNC_INTERVAL", "0"))  # seconds; 0 = off
+IMAGE_SYNC_WORKERS = int(os.getenv("POS_IMAGE_SYNC_WORKERS", "8"))
+_image_sync_lock = threading.Lock()
+_image_sync_thread = None
+
+
+def run_image_sync() -> dict | None:
+    """
+    One delta sync pass into PERSIST_UPLOAD_DIR. Returns the sync stats, or None
+    when no upstream is configured or another thread/worker is already syncing.
+    """
+    list_url = _images_list_url()
+    if not list_url:
+        return None
+    if not _image_sync_lock.acquire(blocking=False):
+        return None
+    try:
+        with _file_lock(PERSIST_UPLOAD_DIR / ".image-sync.lock", blocking=False) as acquired:
+            if not acquired:
+                return None
+            stats = sync_images(list_url, PERSIST_UPLOAD_DIR, _images_api_key(), IMAGE_SYNC_WORKERS)
+        _missing_images.clear()
+        print("[image-sync]", stats)
+        return stats
+    finally:
+        _image_sync_lock.release()
+
+
+def _image_sync_loop():
+    while True:
+        try:
+            run_image_sync()
+        except Exception as e:
+            print("[image-sync] failed:", e)
+        time.sleep(IMAGE_SYNC_INTERVAL)
+
+
+def start_image_sync_job():
+    """Start the background sync thread when POS_IMAGE_SYNC_INTERVAL > 0 (idempotent)."""
+    global _image_sync_thread
+    if IMAGE_SYNC_INTERVAL <= 0 or _image_sync_thread is not None or not _images_list_url():
+        return
+    _image_sync_thread = threading.Thread(target=_image_sync_loop, name="image-sync", daemon=True)
+    _image_sync_thread.start()
+
+
+@bp.cli.command("sync-images")
+def sync_images_command():
+    """Delta-sync upstream images into PERSIST_UPLOAD_DIR."""
+    if not _images_list_url():
+        print("[image-sync] set POS_BASE_URL or POS_IMAGES_LIST_URL")
+        return
+    stats = run_image_sync()
+    if stats is None:
+        print("[image-sync] another sync is already running")
+
+
+def _image_dimensions(path: Path) -> tuple[int, int] | None:
+    """(width, height) read from the PNG/JPEG/WebP header, or None if unrecognized."""
+    try:
+        with path.open("rb") as f:
+            head = f.read(32)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                chunk = head[12:16]
+                if chunk == b"VP8 ":
+                    w, h = struct.unpack("<HH", head[26:30])
+                    return w & 0x3FFF, h & 0x3FFF
+                if chunk == b"VP8L":
+                    b = head[21:25]
+                    w = 1 + (((b[1] & 0x3F) << 8) | b[0])
+                    h = 1 + (((b[3] & 0x0F) << 10) | (b[2] << 2) | ((b[1] & 0xC0) >> 6))
+                    return w, h
+                if chunk == b"VP8X":
+                    return 1 + int.from_bytes(head[24:27], "little"), 1 + int.from_bytes(head[27:30], "little")
+                return None
+            if head[:2] != b"\xff\xd8":
+                return None
+            # JPEG: walk segments until a start-of-frame marker
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                code = marker[1]
+                if code == 0xFF:
+                    f.seek(-1, os.SEEK_CUR)
+                    continue
+                if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+                    continue
+                seg_len = struct.unpack(">H", f.read(2))[0]
+                if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                    h, w = struct.unpack(">xHH", f.read(5))
+                    return w, h
+                f.seek(seg_len - 2, os.SEEK_CUR)
+    except Exception:
+        return None
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _upload_dirs_signature() -> tuple:
+    """Directory mtimes change on create/delete/rename (incl. atomic replace) of entries."""
+    sig = []
+    for d in UPLOAD_DIRS:
+        try:
+            sig.append(os.stat(d).st_mtime_ns)
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+IMAGE_HASH_LEN = 16
+IMAGE_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# In-place overwrites don't touch the dir mtime; re-stat everything at least this often
+IMAGE_MANIFEST_RECHECK_SECONDS = float(os.getenv("POS_IMAGE_MANIFEST_RECHECK", "60"))
+
+
+class ImageManifest:
+    """
+    Cached listing of upload-dir images with size, dimensions and content hash.
+    Rebuilt only when an upload dir's mtime changes (or every RECHECK seconds);
+    a rebuild re-stats files but only re-hashes those whose size/mtime moved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._entries: dict[str, dict] = {}
+        self.version = ""
+        self.payload_json = b""
+
+    def _rebuild(self):
+        previous = self._entries
+        entries = {}
+        for d in UPLOAD_DIRS:
+            try:
+                names = sorted(os.listdir(d))
+            except OSError:
+                continue
+            for name in names:
+                if name in entries or Path(name).suffix.lower() not in IMAGE_EXTS:
+                    continue
+                path = d / name
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                old = previous.get(name)
+                if old and old["dir"] == d and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+                    entries[name] = old
+                    continue
+                dims = _image_dimensions(path)
+                entries[name] = {
+                    "dir": d,
+                    "size": st.st_size,
+                    "mtime_ns": st.st_mtime_ns,
+                    "hash": _file_sha256(path)[:IMAGE_HASH_LEN],
+                    "width": dims[0] if dims else None,
+                    "height": dims[1] if dims else None,
+                }
+        images = [
+            {
+                "filename": name,
+                "url": f"/api/images/v/{e['hash']}/{name}",
+                "hash": e["hash"],
+                "size": e["size"],
+                "width": e["width"],
+                "height": e["height"],
+            }
+            for name, e in entries.items()
+        ]
+        self._entries = entries
+        self.version = hashlib.sha256(
+            "\n".join(f"{i['filename']}:{i['hash']}" for i in images).encode("utf-8")
+        ).hexdigest()[:IMAGE_HASH_LEN]
+        self.payload_json = json.dumps(
+            {"ok": True, "version": self.version, "images": images}, separators=(",", ":")
+        ).encode("utf-8")
+
+    def refresh(self) -> "ImageManifest":
+        sig = _upload_dirs_signature()
+        now = time.monotonic()
+        if sig == self._signature and now - self._checked_at < IMAGE_MANIFEST_RECHECK_SECONDS:
+            return self
+        with self._lock:
+            if sig != self._signature or now - self._checked_at >= IMAGE_MANIFEST_RECHECK_SECONDS:
+                self._rebuild()
+                self._signature = sig
+                self._checked_at = now
+        return self
+
+    def lookup(self, name: str) -> dict | None:
+        return self.refresh()._entries.get(name)
+
+
+_image_manifest = ImageManifest()
+
+
+@bp.route("/public/images", methods=["GET"])
 def public_images_index():
     """
     Public, no-auth listing of available images for the website.
+    Image URLs embed the content hash; the listing itself revalidates via ETag.
+    """
+    manifest = _image_manifest.refresh()
+    resp = Response(manifest.payload_json, mimetype="application/json")
+    resp.set_etag(manifest.version)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["Access-Control-Allow-Origin"] = "*"
+    return resp.make_conditional(request)
+
+
+def _json_bytes(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@bp.get("/public/bootstrap")
+def public_bootstrap():
+    """
+    First-paint bundle replacing /public/menu + /public/images + /me:
+      GET /public/bootstrap?menuVersion=<v>&imagesVersion=<v>
+      -> { ok, menu: { version, stale, catalog|null }, images: {...}|{ version, notModified },
+           user, profile }
+    The menu catalog / image listing are left out when the client already has
+    that version; user/profile are null without a valid bearer token. The
+    response is spliced together from the cached, already-serialized menu body
+    and image manifest, so only the small user part is encoded per request.
+    """
+    parts = [b'{"ok":true']
+
+    try:
+        state = _current_menu()
+        have = request.args.get("menuVersion") == state.version
+        parts.append(b',"menu":{"version":' + _json_bytes(state.version)
+                     + b',"stale":' + (b"true" if state.meta.get("stale") else b"false")
+                     + b',"notModified":' + (b"true" if have else b"false")
+                     + b',"catalog":' + (b"null" if have else state.body) + b"}")
+    except MenuUnavailable as e:
+        parts.append(b',"menu":' + _json_bytes({"error": e.payload.get("error", "menu unavailable")}))
+    except Exception as e:
+        parts.append(b',"menu":' + _json_bytes({"error": f"{e.__class__.__name__}: {e}"}))
+
+    manifest = _image_manifest.refresh()
+    images_json, images_version = manifest.payload_json, manifest.version
+    if request.args.get("imagesVersion") == images_version:
+        parts.append(b',"images":' + _json_bytes({"version": images_version, "notModified": True}))
+    else:
+        parts.append(b',"images":' + images_json)
+
+    u = user_from_bearer() if get_bearer_token() else None
+    me_part = _me_payload(u) if u else {"user": None, "profile": None}
+    parts.append(b"," + _json_bytes(me_part)[1:])
+
+    resp = Response(b"".join(parts), mimetype="application/json")
+    resp.headers["Cache-Control"] = "private, no-store" if u else "no-cache"
+    resp.vary.add("Authorization")
+    return resp
+
+
+@bp.route("/api/images/v/<content_hash>/<path:filename>", methods=["GET"])
+def api_images_hashed(content_hash: str, filename: str):
+    """
+    Content-addressed image URL from /public/images: immutable while the hash
+    matches; a stale hash falls back to the regular (short-cache) lookup.
     """
-    payload = _list_images_payload()
-    resp = jsonify(payload)
+    safe = os.path.basename(filename)
+    entry = _image_manifest.lookup(safe)
+    if not entry or entry["hash"] != content_hash:
+        return api_images_file(safe)
+    resp = send_from_directory(entry["dir"], safe, max_age=31536000)
+    resp.headers["Cache-Control"] = IMAGE_IMMUTABLE_CACHE
     resp.headers["Access-Control-Allow-Origin"] = "*"
     return resp
 
 
-@app.route("/static/uploads/<path:filename>", methods=["GET"])
+@bp.route("/static/uploads/<path:filename>", methods=["GET"])
 def public_static_uploads(filename: str):
     # Reuse the same logic as /api/images
     return api_images_file(filename)
 
 
-@app.route("/api/images/<path:filename>", methods=["GET"])
+@bp.route("/api/images/<path:filename>", methods=["GET"])
 def api_images_file(filename: str):
     """
     Serve image files with a best-effort fallback for naming mismatches.
@@ -969,50 +3010,47 @@ def api_images_file(filename: str):
     """
     safe = os.path.basename(filename)
 
-    # 1) Try direct file in our upload dirs (persistent first, then repo bundled)
-    for d in UPLOAD_DIRS:
-        direct_path = d / safe
-        if direct_path.is_file():
-            return send_from_directory(d, safe)
-
-    # 2) Try fuzzy match across upload dirs
-    req_stem = Path(safe).stem
-    for d in UPLOAD_DIRS:
-        try:
-            files = os.listdir(d)
-        except Exception:
-            continue
-
-        alt = _pick_best_match(req_stem, files)
-        if alt:
-            return send_from_directory(d, alt)
-
-    # 3) Upstream fallback (brother server)
-    upstream_base = _images_upstream_base()
-    if upstream_base:
-        try:
-            upstream_url = f"{upstream_base}/{safe}"
-            key = _images_api_key()
-
-            headers = {}
-            # Apply key if we have one (supports both common patterns)
-            if key:
-                headers["x-api-key"] = key
-                headers["Authorization"] = f"Bearer {key}"
-
-            r = requests.get(upstream_url, headers=headers, timeout=12)
-            if r.ok and r.content:
-                ct = r.headers.get("content-type") or "application/octet-stream"
-                resp = Response(r.content, status=200, mimetype=ct)
-                resp.headers["Cache-Control"] = "public, max-age=86400"  # 24h
-                resp.headers["Access-Control-Allow-Origin"] = "*"
-                return resp
-        except Exception:
-            pass
-
+    # 1) Direct hit in our upload dirs: cheap, never gated
+    local = _find_local_image(safe, fuzzy=False)
+    if local:
+        return send_from_directory(*local)
+
+    # Known miss: skip the dir scans and the upstream round trip
+    if _missing_images.contains(safe):
+        return jsonify({"ok": False, "error": "not found"}), 404
+
+    # Misses (dir scans, upstream round trips) share the "upstream" admission gate,
+    # unless asgi.py already fetched upstream for us
+    upstream = _image_upstream_request(safe)
+    r = _prefetched_upstream(upstream[0]) if upstream else None
+    if r is None:
+        # 2) Fuzzy match in our upload dirs
+        with admission_gates["upstream"].admit():
+            local = _find_local_image(safe)
+        if local:
+            return send_from_directory(*local)
+        # 3) Upstream fallback (brother server), one fetch per filename at a time;
+        # only the leader takes an upstream slot, waiters just share its result
+        if upstream:
+            r = _image_flights.do(safe, lambda: _fetch_image_upstream(safe, upstream))
+            if r is None:
+                local = _find_local_image(safe, fuzzy=False)
+                if local:
+                    return send_from_directory(*local)
+
+    if r and r["status"] and 200 <= r["status"] < 400 and r["body"]:
+        ct = r["content_type"] or "application/octet-stream"
+        resp = Response(r["body"], status=200, mimetype=ct)
+        resp.headers["Cache-Control"] = "public, max-age=86400"  # 24h
+        resp.headers["Access-Control-Allow-Origin"] = "*"
+        return resp
+
+    # Only remember definite misses; upstream timeouts/5xx may succeed next time
+    if not upstream or (r and r["status"] in (404, 410)):
+        _missing_images.add(safe)
     return jsonify({"ok": False, "error": "not found"}), 404
 
-@app.after_request
+@bp.after_app_request
 def add_cors_headers(resp):
     origin = request.headers.get("Origin")
     allowed = [
@@ -1026,11 +3064,100 @@ def add_cors_headers(resp):
     return resp
 
 
-@app.get("/")
+@bp.get("/")
 def home():
     return "<h1>🍕 Pizza Peppers Server is Running</h1>"
 
 
+def create_app(config: dict | None = None) -> Flask:
+    """
+    Build the Flask app. Safe to call in a process that will fork (gunicorn
+    --preload): it leaves no open DB connections or background threads behind
+    when POS_FORK_SAFE_BOOT=1, and on_worker_boot() finishes setup per worker.
+    """
+    app = Flask(__name__, static_folder=None)
+
+    # Ensure instance folder exists for SQLite relative paths (Flask-SQLAlchemy uses it)
+    try:
+        Path(app.instance_path).mkdir(parents=True, exist_ok=True)
+    except Exception as e:
+        print("[db] failed to create instance dir:", e)
+
+    app.config["SECRET_KEY"] = os.getenv("POS_SECRET_KEY", "dev-change-me-now")
+    if DB_PATH:
+        # Ensure parent directory exists (Render disk mount, etc.)
+        try:
+            parent = os.path.dirname(DB_PATH)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+        except Exception as e:
+            print("[db] failed to create DB dir:", e)
+
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DB_PATH}"
+    else:
+        # local/dev fallback
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///users.db"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.update(config or {})
+
+    CORS(
+        app,
+        resources={r"/*": {"origins": ALLOWED_ORIGINS}},
+        allow_headers=[
+            "Content-Type", "content-type",
+            "Authorization",
+            "X-API-Key", "x-api-key",
+            "Accept", "Origin",
+            "X-PP-Profile",
+        ],
+        expose_headers=["X-Menu-Stale", "X-Menu-Snapshot-At", "X-Menu-Version", "X-PP-Profile-Id"],
+        methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+        supports_credentials=False,
+        # Let browsers reuse preflight results instead of repeating OPTIONS per request
+        max_age=CORS_MAX_AGE_SECONDS,
+    )
+    db.init_app(app)
+    app.register_blueprint(bp)
+
+    # init once per process
+    if not firebase_admin._apps:
+        init_firebase_admin()
+
+    with app.app_context():
+        if SQLITE_WAL and db.engine.url.get_backend_name() == "sqlite":
+            event.listen(db.engine, "connect", _sqlite_enable_wal)
+        # Set POS_AUTO_MIGRATE=0 when migrations run as a deploy step (`flask --app app db-upgrade`)
+        if os.getenv("POS_AUTO_MIGRATE", "1") == "1":
+            _ensure_db_ready()
+        # Nothing pooled survives into forked workers
+        db.engine.dispose()
+
+    if os.getenv("POS_FORK_SAFE_BOOT", "0") != "1":
+        start_background_jobs(app)
+    return app
+
+
+def start_background_jobs(app: Flask):
+    start_image_sync_job()
+    start_backup_job(app)
+    order_broker.start(app)
+
+
+def on_worker_boot(app: Flask):
+    """
+    Per-process setup after fork (gunicorn post_fork, see gunicorn.conf.py):
+    drop any DB connections inherited from the parent without closing them
+    under its feet, then start this worker's background jobs.
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
+    start_background_jobs(app)
+
+
+# Module-level app keeps `gunicorn app:app`, `flask --app app` and asgi.py working
+app = create_app()
+
+
 if __name__ == "__main__":
     # Align with dev proxy target
     app.run(host="127.0.0.1", port=5055, debug=True)
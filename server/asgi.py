@@ -0,0 +1,219 @@
+"""
+ASGI entry point for running with upstream I/O off the worker threads:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5055
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+
+Upstream-bound requests (GET /public/menu when POS_MENU_URL is set, and image
+requests that miss every local upload dir) do their upstream wait on the event
+loop with httpx.AsyncClient, one fetch per URL however many requests want it. The finished result is stored on the ASGI scope
+and the request then runs through the normal Flask view, which finds it via
+app._prefetched_upstream() instead of calling requests.get. Everything else
+goes straight to Flask on a bounded thread pool, so hundreds of slow upstream
+waits cost no threads and /login keeps its full pool.
+
+GET /staff/orders/stream (SSE) is served natively here as well: each kitchen
+display is an idle coroutine fed by app.order_broker, not a parked thread.
+"""
+import asyncio
+import os
+import posixpath
+import time
+from urllib.parse import parse_qs
+
+import httpx
+from a2wsgi import WSGIMiddleware
+
+WSGI_THREADS = int(os.getenv("POS_ASGI_WSGI_THREADS", "16"))
+# app.py sizes its admission limits from this, so export it before importing the app
+os.environ.setdefault("POS_WORKER_THREADS", str(WSGI_THREADS))
+
+from app import (
+    app as flask_app,
+    ORDER_STREAM_HEARTBEAT_SECONDS,
+    UPSTREAM_TIMEOUT_SECONDS,
+    _find_local_image,
+    _image_upstream_request,
+    _menu_breaker,
+    _menu_upstream_request,
+    _missing_images,
+    _persist_upstream_image,
+    _sse_event,
+    _upstream_result,
+    order_broker,
+    origin_allowed,
+    staff_user_for_token,
+)
+
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("POS_ASGI_UPSTREAM_MAX_CONNECTIONS", "200"))
+
+_wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+_client: httpx.AsyncClient | None = None
+# url -> task of the upstream fetch in flight; concurrent requests for the same url await it
+_inflight: dict[str, asyncio.Task] = {}
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=UPSTREAM_TIMEOUT_SECONDS,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS),
+        )
+    return _client
+
+
+async def _upstream_get(url: str, headers: dict) -> dict:
+    t0 = time.perf_counter()
+    try:
+        r = await _get_client().get(url, headers=headers)
+        return _upstream_result(url, r.status_code, r.content, r.headers.get("content-type") or "",
+                                elapsed_ms=(time.perf_counter() - t0) * 1000)
+    except Exception as e:
+        return _upstream_result(url, error=f"{e.__class__.__name__}: {e}",
+                                elapsed_ms=(time.perf_counter() - t0) * 1000)
+
+
+async def _fetch_upstream(url: str, headers: dict, image_name: str = "") -> dict:
+    result = await _upstream_get(url, headers)
+    if image_name:
+        # Land the image on disk so later requests (any worker) are local hits
+        await asyncio.to_thread(_persist_upstream_image, image_name, result)
+    return result
+
+
+async def _shared_upstream_get(url: str, headers: dict, image_name: str = "") -> dict:
+    """
+    Single-flight twin of app._image_flights for the event loop: one fetch per url
+    in flight, shared by every concurrent request. The fetch runs as its own task,
+    so a disconnecting first client doesn't cancel it for the others.
+    """
+    task = _inflight.get(url)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_upstream(url, headers, image_name))
+        _inflight[url] = task
+        task.add_done_callback(lambda _t: _inflight.pop(url, None))
+    return await asyncio.shield(task)
+
+
+async def _upstream_for(scope) -> tuple[str, dict, str] | None:
+    """
+    (url, headers, image name or "") this request will need from upstream, or
+    None to go straight to Flask. Only the direct stat runs on the loop; the
+    fuzzy upload-dir scan goes to a worker thread.
+    """
+    if scope["method"] != "GET":
+        return None
+    path = scope["path"]
+    if path == "/public/menu":
+        upstream = _menu_upstream_request()
+        # Open breaker: let the Flask view serve the snapshot without waiting on upstream
+        return (*upstream, "") if upstream and _menu_breaker.allow() else None
+    for prefix in ("/api/images/", "/static/uploads/"):
+        if path.startswith(prefix) and len(path) > len(prefix):
+            safe = posixpath.basename(path)
+            if not safe or _find_local_image(safe, fuzzy=False):
+                return None
+            if _missing_images.contains(safe, count=False) or await asyncio.to_thread(_find_local_image, safe):
+                return None
+            upstream = _image_upstream_request(safe)
+            return (*upstream, safe) if upstream else None
+    return None
+
+
+def _header(scope, name: bytes) -> str:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin1")
+    return ""
+
+
+def _authorized_staff(token: str) -> bool:
+    with flask_app.app_context():
+        return staff_user_for_token(token) is not None
+
+
+async def _order_stream(scope, receive, send):
+    """Native async twin of app.staff_orders_stream (same auth, resume and event format)."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin1"))
+    auth = _header(scope, b"authorization")
+    token = auth.split(" ", 1)[1].strip() if auth.lower().startswith("bearer ") else (query.get("token") or [""])[0]
+    headers = [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+               (b"x-accel-buffering", b"no")]
+    origin = _header(scope, b"origin")
+    if origin and origin_allowed(origin):
+        headers += [(b"access-control-allow-origin", origin.encode("latin1")), (b"vary", b"Origin")]
+
+    if not token or not await asyncio.to_thread(_authorized_staff, token):
+        await send({"type": "http.response.start", "status": 401,
+                    "headers": [(b"content-type", b"application/json")] + headers[3:]})
+        await send({"type": "http.response.body", "body": b'{"ok":false,"error":"Unauthorized"}'})
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def listener(ev):
+        loop.call_soon_threadsafe(queue.put_nowait, ev)
+
+    # Subscribe before reading the backlog so nothing published in between is lost
+    order_broker.subscribe(listener)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        last_event_id = _header(scope, b"last-event-id") or (query.get("lastEventId") or [""])[0]
+        backlog, seq = order_broker.since(last_event_id or None)
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        chunk = "retry: 3000\n\n" + "".join(_sse_event(ev) for ev in backlog)
+        await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+        while not disconnected.done():
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, disconnected}, timeout=ORDER_STREAM_HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                if not disconnected.done():
+                    await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+                continue
+            ev = getter.result()
+            if ev["seq"] > seq:
+                seq = ev["seq"]
+                await send({"type": "http.response.body", "body": _sse_event(ev).encode("utf-8"),
+                            "more_body": True})
+    finally:
+        order_broker.unsubscribe(listener)
+        disconnected.cancel()
+
+
+async def _wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _lifespan(receive, send):
+    global _client
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _client is not None:
+                await _client.aclose()
+                _client = None
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] == "http":
+        if scope["method"] == "GET" and scope["path"] == "/staff/orders/stream":
+            await _order_stream(scope, receive, send)
+            return
+        upstream = await _upstream_for(scope)
+        if upstream:
+            scope = dict(scope)
+            scope["pp.upstream"] = await _shared_upstream_get(*upstream)
+    await _wsgi(scope, receive, send)
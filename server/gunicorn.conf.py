@@ -0,0 +1,51 @@
+"""
+Preload-safe gunicorn settings:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master (preload_app) so workers share its
+warmed memory copy-on-write. create_app() leaves no DB connections or threads
+behind under POS_FORK_SAFE_BOOT, and post_fork hands each worker a fresh
+connection pool and its own background jobs via app.on_worker_boot().
+
+Kitchen displays (GET /staff/orders/stream) belong on the ASGI entry point,
+where each open display is an idle coroutine instead of a parked thread:
+
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py asgi:application
+
+Under gthread workers app.py serves at most POS_ORDER_STREAM_WSGI_LIMIT
+streams per worker (a quarter of its threads) and answers the rest with
+503 + Retry-After: 10, enough for a display or two but not a kitchen.
+"""
+import gc
+import os
+
+# Read by create_app() while the master preloads the app
+os.environ.setdefault("POS_FORK_SAFE_BOOT", "1")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5055')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Threaded workers: app.py's per-route admission limits (and the WSGI order
+# stream cap) are shares of these threads, so a flood of one route class
+# queues or sheds while /login and /api/orders keep free threads
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+preload_app = True
+
+# Read by app.py at import (the master preloads it after this file); under the
+# uvicorn worker asgi.py sets it from its own WSGI thread pool instead
+if "uvicorn" not in worker_class:
+    os.environ.setdefault("POS_WORKER_THREADS", str(threads if worker_class == "gthread" else 1))
+
+
+def when_ready(server):
+    # Move everything the preload allocated out of the GC's reach, so collections
+    # in workers don't write to (and un-share) those pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app as pos_app
+
+    pos_app.on_worker_boot(pos_app.app)
@@ -0,0 +1,173 @@
+"""
+Delta image sync from the upstream POS server into a local uploads dir.
+
+Lists upstream images, compares them with a local manifest (size, sha256,
+ETag, Last-Modified) and downloads only new or changed files on a bounded
+thread pool. Unchanged files cost one conditional GET (304), or nothing when
+the listing already carries a matching hash/ETag. Files land atomically.
+
+The server wires this up as `flask --app app sync-images` and an optional
+background job (POS_IMAGE_SYNC_INTERVAL). It can also run standalone:
+
+    python image_sync.py --list-url https://pos.example/api/images/ --dest data/uploads
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin
+
+import requests
+
+MANIFEST_NAME = ".image-sync.json"
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """Write via a temp file in the same dir + os.replace, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _load_manifest(dest: Path) -> dict:
+    try:
+        with (dest / MANIFEST_NAME).open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print("[image-sync] ignoring unreadable manifest:", e)
+        return {}
+
+
+def _listing_entries(payload, list_url: str) -> list[dict]:
+    """Normalize the upstream listing to [{filename, url, size?, sha256?, etag?}]."""
+    items = payload.get("images", []) if isinstance(payload, dict) else payload
+    out = []
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, str):
+            item = {"filename": item}
+        if not isinstance(item, dict):
+            continue
+        name = os.path.basename(str(item.get("filename") or item.get("name") or ""))
+        if not name or name.startswith(".") or Path(name).suffix.lower() not in IMAGE_EXTS:
+            continue
+        url = item.get("url") or name
+        out.append({
+            "filename": name,
+            "url": urljoin(list_url, url),
+            "size": item.get("size"),
+            "sha256": item.get("sha256") or item.get("hash"),
+            "etag": item.get("etag"),
+        })
+    return out
+
+
+def _listing_matches(entry: dict, known: dict) -> bool:
+    """True when the listing alone proves our copy is current (no request needed)."""
+    if entry["sha256"] and entry["sha256"] == known.get("sha256"):
+        return True
+    if entry["etag"] and entry["etag"] == known.get("etag"):
+        return entry["size"] is None or entry["size"] == known.get("size")
+    return False
+
+
+def sync_images(list_url: str, dest: Path, api_key: str = "", workers: int = 8, timeout: float = 30) -> dict:
+    """Sync upstream images into `dest`; returns counters for logging/monitoring."""
+    started = time.monotonic()
+    dest = Path(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    headers = {"x-api-key": api_key, "Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    res = requests.get(list_url, headers={**headers, "Accept": "application/json"}, timeout=timeout)
+    res.raise_for_status()
+    entries = _listing_entries(res.json(), list_url)
+
+    manifest = _load_manifest(dest)
+    stats = {"listed": len(entries), "downloaded": 0, "unchanged": 0, "failed": 0, "bytes": 0}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def session() -> requests.Session:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def sync_one(entry: dict):
+        name = entry["filename"]
+        path = dest / name
+        known = manifest.get(name) or {}
+        have_file = bool(known) and path.is_file() and path.stat().st_size == known.get("size")
+        if have_file and _listing_matches(entry, known):
+            return name, known, "unchanged", 0
+
+        req_headers = dict(headers)
+        if have_file and known.get("etag"):
+            req_headers["If-None-Match"] = known["etag"]
+        if have_file and known.get("last_modified"):
+            req_headers["If-Modified-Since"] = known["last_modified"]
+        r = session().get(entry["url"], headers=req_headers, timeout=timeout)
+        if r.status_code == 304 and have_file:
+            return name, known, "unchanged", 0
+        r.raise_for_status()
+        body = r.content
+        record = {
+            "size": len(body),
+            "sha256": hashlib.sha256(body).hexdigest(),
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
+        if have_file and record["sha256"] == known.get("sha256"):
+            return name, record, "unchanged", 0
+        atomic_write_bytes(path, body)
+        return name, record, "downloaded", len(body)
+
+    def run(entry: dict):
+        try:
+            name, record, outcome, nbytes = sync_one(entry)
+        except Exception as e:
+            print(f"[image-sync] {entry['filename']} failed: {e.__class__.__name__}: {e}")
+            with lock:
+                stats["failed"] += 1
+            return
+        with lock:
+            manifest[name] = record
+            stats[outcome] += 1
+            stats["bytes"] += nbytes
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(run, entries))
+
+    atomic_write_bytes(dest / MANIFEST_NAME, json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8"))
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Delta-sync upstream POS images into a local dir.")
+    ap.add_argument("--list-url", required=True, help="upstream listing URL, e.g. https://pos.example/api/images/")
+    ap.add_argument("--dest", required=True, help="destination uploads dir")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--api-key", default=os.getenv("POS_IMAGES_API_KEY", ""))
+    args = ap.parse_args()
+    print("[image-sync]", sync_images(args.list_url, Path(args.dest), args.api_key, args.workers))
+
+
+if __name__ == "__main__":
+    main()